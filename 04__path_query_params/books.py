@@ -1,16 +1,79 @@
 
-from fastapi import FastAPI, Path, Query, HTTPException
-from typing import List, Optional
+from fastapi import FastAPI, Path, Query, HTTPException, Request, Response
+from typing import List, NamedTuple, Optional, Tuple
 from enum import Enum
+from contextlib import asynccontextmanager
 from pydantic import BaseModel
 import re 
+import base64
 import json
+import os
+import pathlib
+import sys
 
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from catalog import Catalog, ColumnarCatalog, SqliteCatalog
+from common.cache import TTLCache
+from common.metrics import install_metrics
+from common.records import CompactRecord, freeze_heap
+from common.responses import FastJSONResponse, conditional_headers, not_modified
+from common.store import ExistsError
+from common.watch import FileWatcher
 
-app = FastAPI(title="Bookstore Application API")
 
 JSON_FILE = "books.json"
 
+# "memory" keeps books.json resident with in-memory indexes; "columnar" also
+# keeps the filterable fields as NumPy arrays (needs numpy) and filters with
+# vectorised masks; "sqlite" keeps the catalog in books.db (seeded from
+# books.json on first start) and runs GET /books/ filters, sorting and
+# paging as indexed SQL.
+BOOKS_BACKEND = os.getenv("BOOKS_BACKEND", "memory")
+
+
+# resident form of a book in the memory and columnar catalogs
+class BookRecord(CompactRecord):
+    __slots__ = ("id", "isbn", "title", "author", "programming_language", "publisher", "price", "publication_year")
+    INTERNED = ("author", "programming_language", "publisher", "price", "publication_year")
+
+
+if BOOKS_BACKEND == "columnar":
+    catalog = ColumnarCatalog(JSON_FILE, record_type=BookRecord)
+elif BOOKS_BACKEND == "sqlite":
+    catalog = SqliteCatalog("books.db", seed_path=JSON_FILE)
+else:
+    catalog = Catalog(JSON_FILE, record_type=BookRecord)
+
+# Results of recent GET /books/ queries; BOOKS_CACHE_SIZE=0 turns it off.
+books_cache = TTLCache(
+    "books",
+    maxsize=int(os.getenv("BOOKS_CACHE_SIZE", 1024)),
+    ttl=float(os.getenv("BOOKS_CACHE_TTL", 30)),
+)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await catalog.aload()
+    freeze_heap()
+    # hand edits of books.json are picked up without a restart; with SQLite
+    # the file is only the initial seed
+    watcher = None
+    if isinstance(catalog, Catalog):
+        watcher = FileWatcher(catalog, on_reload=books_cache.invalidate).start()
+    yield
+    if watcher is not None:
+        watcher.stop()
+    catalog.close()
+
+
+app = FastAPI(title="Bookstore Application API", lifespan=lifespan, default_response_class=FastJSONResponse)
+
+# request counts, latency histograms and stage timings at /metrics
+metrics = install_metrics(app)
+metrics.add_collector(books_cache.render_metrics)
+
 ISBN_PATTERN = r"^978-\d{10}-\d$"
 
 
@@ -48,21 +111,56 @@ class SortField(str, Enum):
     publication_year = "publication_year"
 
 
-def load_books():
-    try:
-        with open('books.json', 'r') as f:
-            return json.load(f)
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=500, detail="Corrupted JSON file")
-
+class BooksQuery(NamedTuple):
+    """GET /books/ parameters normalised so equivalent requests share a cache key.
 
-# Save books to JSON file
-def save_books(books):
+    Field names match ``catalog.query`` so the tuple can be passed straight
+    through. Search and publisher are matched case-insensitively and the
+    language filter is a set, so those are lowercased or sorted here.
+    """
+    search: Optional[str]
+    programming_languages: Tuple[str, ...]
+    publisher: Optional[str]
+    min_price: Optional[float]
+    max_price: Optional[float]
+    sort_field: str
+    descending: bool
+    skip: int
+    limit: int
+    after: Optional[tuple]
+
+    def matches(self, book: dict) -> bool:
+        """Whether ``book`` passes the filters, i.e. adding it can change the result."""
+        if self.search and self.search not in book["title"].lower() and self.search not in book["author"].lower():
+            return False
+        if self.programming_languages and book["programming_language"] not in self.programming_languages:
+            return False
+        if self.publisher and book["publisher"].lower() != self.publisher:
+            return False
+        if self.min_price is not None and book["price"] < self.min_price:
+            return False
+        if self.max_price is not None and book["price"] > self.max_price:
+            return False
+        return True
+
+
+# Opaque keyset cursor: the sort it was issued for plus the (value, id) of
+# the last book on the page, so the next page starts right after it.
+def encode_cursor(sort_field: SortField, sort_order: SortOrder, book: dict) -> str:
+    payload = json.dumps([sort_field.value, sort_order.value, book[sort_field.value], book["id"]])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor: str, sort_field: SortField, sort_order: SortOrder) -> tuple:
     try:
-        with open(JSON_FILE, "w") as f:
-            json.dump(books, f, indent=4)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to save data: {str(e)}")
+        field, order, value, book_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(value, (int, float)) or not isinstance(book_id, int):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if (field, order) != (sort_field.value, sort_order.value):
+        raise HTTPException(status_code=400, detail="Cursor was issued for a different sort_field or sort_order")
+    return value, book_id
 
 
 @app.get("/books/isbn/{isbn}", response_model=Book)
@@ -71,12 +169,10 @@ async def get_book_by_isbn(isbn: str = Path(..., description="ISBN of the book e
     """
     Retrieve a book by its ISBN.
     """
-    books = load_books()
-    for book in books:
-        if book['isbn'] == isbn:
-            return book
-        else:
-            raise HTTPException(status_code=404, detail="Book not found")
+    book = catalog.get_by_isbn(isbn)
+    if book is None:
+        raise HTTPException(status_code=404, detail="Book not found")
+    return book
 
 
 
@@ -87,15 +183,17 @@ async def get_book_by_id(book_id :int = Path(..., ge=1, description="ID of book(
     """
     Return book by its id
     """
-    books = load_books()
-    for book in books:
-        if book["id"] == book_id:
-            return book
-    raise HTTPException(status_code=404, detail="Book not found")
+    book = catalog.get_by_id(book_id)
+    if book is None:
+        raise HTTPException(status_code=404, detail="Book not found")
+    return book
 
 
 @app.get("/books/", response_model=List[Book])
 async def get_books(
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor header of the previous page; continues after its last book"),
     skip:int = Query(0, ge=0, description="No of books ot skip pagination"),
     limit:int = Query(10, ge=1, le=100, description="Maximum number of books to return"),
     search: Optional[str] = Query(None, min_length=3, max_length=50, description="Search by title or author"),
@@ -106,46 +204,38 @@ async def get_books(
     sort_field: SortField = Query(..., description="Field to sort by (price or publication_year)"),
     sort_order: SortOrder = Query(..., description="Sort order (asc or desc)")
 ):
-    books = load_books()
-    filtered_books = books
-
-        # Apply search filter (title or author)
-    if search:
-        search = search.lower()
-        filtered_books = [
-            book for book in filtered_books
-            if search in book["title"].lower() or search in book["author"].lower()
-        ]
-
-    # Apply programming language filter
-    if programming_languages:
-        filtered_books = [
-            book for book in filtered_books
-            if book["programming_language"] in programming_languages
-        ]
-
-    # Apply publisher filter
-    if publisher:
-        filtered_books = [
-            book for book in filtered_books
-            if book["publisher"].lower() == publisher.lower()
-        ]
-
-    # Apply price range filter
-    if min_price is not None:
-        filtered_books = [book for book in filtered_books if book["price"] >= min_price]
-    if max_price is not None:
-        filtered_books = [book for book in filtered_books if book["price"] <= max_price]
-
-    # Sort by specified field
-    filtered_books = sorted(
-        filtered_books,
-        key=lambda x: x[sort_field],
-        reverse=(sort_order == SortOrder.desc)
+    """
+    Return one page of books. A full page carries an X-Next-Cursor header;
+    passing it back as ``cursor`` fetches the next page at the cost of the first.
+    Polls with a current If-None-Match get a 304 without running the query.
+    """
+    headers = conditional_headers(catalog.stamp)
+    unchanged = not_modified(request, headers)
+    if unchanged is not None:
+        return unchanged
+    response.headers.update(headers)
+    query = BooksQuery(
+        search=search.lower() if search else None,
+        programming_languages=tuple(sorted(set(programming_languages))),
+        publisher=publisher.lower() if publisher else None,
+        min_price=min_price,
+        max_price=max_price,
+        sort_field=sort_field.value,
+        descending=(sort_order == SortOrder.desc),
+        skip=skip,
+        limit=limit,
+        after=decode_cursor(cursor, sort_field, sort_order) if cursor else None,
     )
-
-    # Apply pagination
-    return filtered_books[skip:skip + limit]
+    books = books_cache.get(query)
+    if books is None:
+        version = catalog.stamp.version
+        books = catalog.query(**query._asdict())
+        # a book added while the query ran may or may not be in the result
+        if catalog.stamp.version == version:
+            books_cache.put(query, books)
+    if len(books) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(sort_field, sort_order, books[-1])
+    return books
 
 
 @app.post("/books/", response_model=Book)
@@ -153,26 +243,20 @@ async def add_book(book: BookCreate):
     """
     Add a new book to the inventory.
     """
-    books = load_books()
-
     # Validate ISBN format
     if not re.match(ISBN_PATTERN, book.isbn):
         raise HTTPException(status_code=422, detail="Invalid ISBN format")
 
-    # Check for duplicate ISBN
-    if any(b["isbn"] == book.isbn for b in books):
+    # Create new book with the next id, index it and save to JSON; the
+    # catalog refuses a duplicate ISBN under its lock
+    fields = book.dict()
+    try:
+        new_book = await catalog.aadd(fields)
+    except ExistsError:
         raise HTTPException(status_code=400, detail="Book with this ISBN already exists")
-
-    # Generate new ID
-    new_id = max(b["id"] for b in books) + 1 if books else 1
-
-    # Create new book
-    new_book = {
-        "id": new_id,
-        **book.dict()
-    }
-
-    # Add to books and save to JSON
-    books.append(new_book)
-    save_books(books)
+    finally:
+        # only cached queries the new book passes the filters of can have
+        # changed; a failed save too, as one may have cached the book before
+        # it was rolled back
+        books_cache.invalidate(lambda query: query.matches(fields))
     return new_book
\ No newline at end of file
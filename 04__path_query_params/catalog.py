@@ -0,0 +1,558 @@
+"""Book catalogs: resident with in-memory indexes, columnar, or SQLite-backed.
+
+Both classes expose the same methods, so ``books.py`` can switch between
+them with ``BOOKS_BACKEND``.
+"""
+import asyncio
+import functools
+import heapq
+import json
+import os
+import sqlite3
+import threading
+from collections import defaultdict, namedtuple
+
+from fastapi import HTTPException
+
+try:
+    import numpy as np
+except ImportError:  # only ColumnarCatalog needs it
+    np = None
+
+from common.indexes import SortedIndex
+from common.metrics import timed
+from common.records import COMPACT_RECORDS, compact, loading
+from common.sqlite import SqliteStore
+from common.store import (
+    STORE_GROUP_COMMIT, ExistsError, GroupCommit, VersionStamp, file_signature, fsync_directory, resolved, run_io,
+    write_json_temp,
+)
+
+
+NGRAM = 3
+
+# Fields GET /books/ can sort by. Pages are ordered by (field, id) so ties
+# have a stable order and a page boundary can be resumed from.
+SORT_FIELDS = ("price", "publication_year")
+
+
+def ngrams(text, n=NGRAM):
+    """Distinct ``n``-character substrings of ``text``."""
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+# Everything a read needs, built together and swapped in with one assignment
+# so a reader never pairs the indexes of one load with the books of another.
+CatalogView = namedtuple("CatalogView", "books by_id by_isbn order grams sorted")
+ColumnarView = namedtuple("ColumnarView", CatalogView._fields + ("columns", "codes", "size"))
+
+
+class Catalog:
+    """Books kept in memory in file order, indexed by id and ISBN.
+
+    The indexes and the next id are built once by ``load`` and kept up to
+    date by ``add``, so lookups, duplicate checks and id allocation do not
+    scan the list. Lowercased titles and authors are also indexed by
+    trigram so ``search`` only verifies books that share every trigram of
+    the query, and kept sorted by each of ``SORT_FIELDS`` so an unfiltered
+    page is a slice rather than a sort.
+
+    With ``group_commit``, books added at the same time are saved with one
+    write of books.json (see ``GroupCommit``). With a ``record_type`` books
+    are held as compact records instead of dicts. Reads take ``_view`` once
+    and work from that, so a reload in another thread cannot mix old and
+    new indexes under them.
+    """
+
+    def __init__(self, path, indent=4, group_commit=STORE_GROUP_COMMIT, record_type=None):
+        self.path = path
+        self.indent = indent
+        self.record_type = record_type if COMPACT_RECORDS else None
+        self._view = self._build([])
+        self.next_id = 1
+        self.stamp = VersionStamp()
+        self._disk_signature = None
+        self._lock = threading.RLock()
+        self._commits = GroupCommit(self._lock, self._snapshot, self._write) if group_commit else None
+
+    def load(self):
+        with self._lock, loading(self.record_type):
+            signature = file_signature(self.path)
+            try:
+                with open(self.path, 'r') as f, timed('storage'):
+                    books = json.load(f, object_hook=self.record_type and self.record_type.from_dict)
+            except FileNotFoundError:
+                books = []
+            except json.JSONDecodeError:
+                raise HTTPException(status_code=500, detail="Corrupted JSON file")
+            self._install(books)
+            self._disk_signature = signature
+            self.stamp.loaded(self.path)
+        return books
+
+    def reload_if_changed(self):
+        """Reload if books.json changed since the catalog last read or wrote it."""
+        with self._lock:
+            if self._commits is not None and not self._commits.idle:
+                return False
+            if file_signature(self.path) == self._disk_signature:
+                return False
+            self.load()
+            return True
+
+    @property
+    def books(self):
+        return self._view.books
+
+    @property
+    def by_id(self):
+        return self._view.by_id
+
+    @property
+    def by_isbn(self):
+        return self._view.by_isbn
+
+    def _install(self, books):
+        """Build every index for ``books`` aside, then swap them all in at once."""
+        if self.record_type is not None:
+            books = [self.record_type.from_dict(book) for book in books]
+        view = self._build(books)
+        self._view, self.next_id = view, max(view.by_id, default=0) + 1
+
+    def _build(self, books):
+        by_id = {book["id"]: book for book in books}
+        order = {}
+        grams = defaultdict(set)
+        for position, book in enumerate(books):
+            order[book["id"]] = position
+            for gram in ngrams(book["title"].lower()) | ngrams(book["author"].lower()):
+                grams[gram].add(book["id"])
+        sorted_indexes = {field: SortedIndex(field) for field in SORT_FIELDS}
+        for index in sorted_indexes.values():
+            index.rebuild(by_id)
+        return CatalogView(books, by_id, {book["isbn"]: book for book in books}, order, grams, sorted_indexes)
+
+    def save(self):
+        with self._lock:
+            self._write(self.books)
+
+    def _snapshot(self, books):
+        return list(self.books)
+
+    def _write(self, books):
+        try:
+            with timed('storage'):
+                tmp_path = write_json_temp(self.path, books, indent=self.indent)
+                with self._lock:
+                    os.replace(tmp_path, self.path)
+                    self._disk_signature = file_signature(self.path)
+                fsync_directory(self.path)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to save data: {str(e)}")
+
+    def __len__(self):
+        return len(self.books)
+
+    def get_by_id(self, book_id):
+        return self.by_id.get(book_id)
+
+    def get_by_isbn(self, isbn):
+        return self.by_isbn.get(isbn)
+
+    def _index_text(self, book, position):
+        view = self._view
+        view.order[book["id"]] = position
+        for gram in ngrams(book["title"].lower()) | ngrams(book["author"].lower()):
+            view.grams[gram].add(book["id"])
+
+    def _unindex_text(self, book):
+        view = self._view
+        del view.order[book["id"]]
+        for gram in ngrams(book["title"].lower()) | ngrams(book["author"].lower()):
+            view.grams[gram].discard(book["id"])
+            if not view.grams[gram]:
+                del view.grams[gram]
+
+    def search(self, text):
+        """Books whose title or author contains ``text``, in catalog order.
+
+        Text shorter than ``NGRAM`` has no trigrams and falls back to a scan.
+        """
+        return self._search(self._view, text)
+
+    def _search(self, view, text):
+        text = text.lower()
+        if len(text) < NGRAM:
+            return [book for book in view.books if text in book["title"].lower() or text in book["author"].lower()]
+        postings = []
+        for gram in ngrams(text):
+            ids = view.grams.get(gram)
+            if not ids:
+                return []
+            postings.append(ids)
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for ids in postings[1:]:
+            candidates &= ids
+            if not candidates:
+                return []
+        matches = [
+            view.by_id[book_id] for book_id in candidates
+            if text in view.by_id[book_id]["title"].lower() or text in view.by_id[book_id]["author"].lower()
+        ]
+        matches.sort(key=lambda book: view.order[book["id"]])
+        return matches
+
+    def query(self, search=None, programming_languages=(), publisher=None, min_price=None, max_price=None,
+              sort_field="price", descending=False, skip=0, limit=10, after=None):
+        """One page of books matching the filters, ordered by (``sort_field``, id).
+
+        ``after`` is the (value, id) of the last book of the previous page;
+        only books past it in that order are returned.
+        """
+        view = self._view
+        if not (search or programming_languages or publisher or min_price is not None or max_price is not None):
+            # Nothing to filter: read the page straight off the sort index
+            book_ids = view.sorted[sort_field].keys(reverse=descending, offset=skip, limit=limit, after=after)
+            return [view.by_id[book_id] for book_id in book_ids]
+
+        filtered_books = view.books
+
+        # Apply search filter (title or author) through the trigram index
+        if search:
+            filtered_books = self._search(view, search)
+
+        # Apply programming language filter
+        if programming_languages:
+            filtered_books = [
+                book for book in filtered_books
+                if book["programming_language"] in programming_languages
+            ]
+
+        # Apply publisher filter
+        if publisher:
+            filtered_books = [
+                book for book in filtered_books
+                if book["publisher"].lower() == publisher.lower()
+            ]
+
+        # Apply price range filter
+        if min_price is not None:
+            filtered_books = [book for book in filtered_books if book["price"] >= min_price]
+        if max_price is not None:
+            filtered_books = [book for book in filtered_books if book["price"] <= max_price]
+
+        def sort_key(book):
+            return (book[sort_field], book["id"])
+
+        # Resume after the cursor
+        if after is not None:
+            after = tuple(after)
+            filtered_books = [
+                book for book in filtered_books
+                if (sort_key(book) < after if descending else sort_key(book) > after)
+            ]
+
+        # Select only the books up to the end of the page instead of sorting every match
+        select = heapq.nlargest if descending else heapq.nsmallest
+        return select(skip + limit, filtered_books, key=sort_key)[skip:]
+
+    async def aload(self):
+        return await run_io(self.load)
+
+    async def aadd(self, fields):
+        book, durable = await run_io(self._submit, fields)
+        with timed('storage'):
+            await asyncio.wrap_future(durable)
+        return book
+
+    def close(self):
+        if self._commits is not None:
+            self._commits.close()
+
+    def add(self, fields):
+        """Assign the next id to ``fields``, index the new book and save."""
+        book, durable = self._submit(fields)
+        with timed('storage'):
+            durable.result()
+        return book
+
+    def _submit(self, fields):
+        with self._lock:
+            # checked with the add, under the lock, so an ISBN is never stored twice
+            if fields["isbn"] in self.by_isbn:
+                raise ExistsError(fields["isbn"])
+            book = self._add(fields)
+            self.stamp.bump()
+            if self._commits is not None:
+                return book, self._commits.submit([book], functools.partial(self._remove, book))
+            try:
+                self.save()
+            except Exception:
+                self._remove(book)
+                raise
+            return book, resolved()
+
+    def _add(self, fields):
+        view = self._view
+        book = compact(self.record_type, {"id": self.next_id, **fields})
+        view.books.append(book)
+        view.by_id[book["id"]] = book
+        view.by_isbn[book["isbn"]] = book
+        self._index_text(book, len(view.books) - 1)
+        for index in view.sorted.values():
+            index.insert(book["id"], book)
+        self.next_id += 1
+        return book
+
+    def _remove(self, book):
+        """Undo ``_add`` of the last book, when it could not be saved."""
+        view = self._view
+        view.books.pop()
+        del view.by_id[book["id"]]
+        del view.by_isbn[book["isbn"]]
+        self._unindex_text(book)
+        for index in view.sorted.values():
+            index.remove(book["id"], book)
+        self.next_id -= 1
+        self.stamp.bump()
+
+
+class ColumnarCatalog(Catalog):
+    """Resident catalog that also keeps the filterable fields as NumPy columns.
+
+    Price and publication year are numeric arrays and publisher (lowercased)
+    and programming language are dictionary-encoded integer codes, all
+    aligned with ``books``. A filtered query becomes a boolean mask, the
+    page is picked with ``partition`` and ``lexsort`` on the masked rows,
+    and only the books on the page are looked up. Unfiltered pages still
+    come from the sort index. The columns and the number of rows in use
+    are part of the view, so they always belong to its ``books``.
+    """
+
+    def __init__(self, path, indent=4, group_commit=STORE_GROUP_COMMIT, record_type=None):
+        if np is None:
+            raise RuntimeError("ColumnarCatalog needs numpy; install it or use another BOOKS_BACKEND")
+        super().__init__(path, indent, group_commit, record_type)
+
+    def _encode(self, field, value):
+        codes = self._view.codes[field]
+        return codes.setdefault(value, len(codes))
+
+    def _append_columns(self, book):
+        view = self._view
+        columns, row = view.columns, view.size
+        if row == len(columns["id"]):
+            grown = {}
+            for name, column in columns.items():
+                grown[name] = np.empty(max(16, 2 * len(column)), dtype=column.dtype)
+                grown[name][:row] = column[:row]
+            columns = grown
+        # rows at and past ``size`` are not read, so the new row is filled in place
+        columns["id"][row] = book["id"]
+        columns["price"][row] = book["price"]
+        columns["publication_year"][row] = book["publication_year"]
+        columns["publisher"][row] = self._encode("publisher", book["publisher"].lower())
+        columns["programming_language"][row] = self._encode("programming_language", book["programming_language"])
+        self._view = view._replace(columns=columns, size=row + 1)
+
+    def _build(self, books):
+        codes = {"publisher": {}, "programming_language": {}}
+
+        def encode(field, value):
+            return codes[field].setdefault(value, len(codes[field]))
+
+        columns = {
+            "id": np.array([book["id"] for book in books], dtype=np.int64),
+            "price": np.array([book["price"] for book in books], dtype=np.float64),
+            "publication_year": np.array([book["publication_year"] for book in books], dtype=np.int64),
+            "publisher": np.array([encode("publisher", book["publisher"].lower()) for book in books], dtype=np.int32),
+            "programming_language": np.array(
+                [encode("programming_language", book["programming_language"]) for book in books], dtype=np.int32),
+        }
+        return ColumnarView(*super()._build(books), columns, codes, len(books))
+
+    def _add(self, fields):
+        book = super()._add(fields)
+        self._append_columns(book)
+        return book
+
+    def _remove(self, book):
+        # drop the row before the book, so no reader sees a row without one
+        self._view = self._view._replace(size=self._view.size - 1)
+        super()._remove(book)
+
+    def query(self, search=None, programming_languages=(), publisher=None, min_price=None, max_price=None,
+              sort_field="price", descending=False, skip=0, limit=10, after=None):
+        if not (search or programming_languages or publisher or min_price is not None or max_price is not None):
+            return super().query(sort_field=sort_field, descending=descending, skip=skip, limit=limit, after=after)
+
+        view = self._view
+        n = view.size
+        columns = {name: column[:n] for name, column in view.columns.items()}
+        mask = np.ones(n, dtype=bool)
+
+        if search:
+            matched = np.zeros(n, dtype=bool)
+            rows = [view.order[book["id"]] for book in self._search(view, search)]
+            matched[[row for row in rows if row < n]] = True
+            mask &= matched
+        if programming_languages:
+            languages = view.codes["programming_language"]
+            codes = [languages[language] for language in programming_languages if language in languages]
+            mask &= np.isin(columns["programming_language"], codes)
+        if publisher:
+            code = view.codes["publisher"].get(publisher.lower())
+            if code is None:
+                return []
+            mask &= columns["publisher"] == code
+        if min_price is not None:
+            mask &= columns["price"] >= min_price
+        if max_price is not None:
+            mask &= columns["price"] <= max_price
+
+        values, ids = columns[sort_field], columns["id"]
+        if after is not None:
+            value, book_id = after
+            if descending:
+                mask &= (values < value) | ((values == value) & (ids < book_id))
+            else:
+                mask &= (values > value) | ((values == value) & (ids > book_id))
+
+        rows = np.flatnonzero(mask)
+        keys, tiebreak = values[rows], ids[rows]
+        if descending:
+            keys, tiebreak = -keys, -tiebreak
+        # Keep only rows that can land on the page before sorting them
+        end = skip + limit
+        if end < len(rows):
+            kth = np.partition(keys, end - 1)[end - 1]
+            near = keys <= kth
+            rows, keys, tiebreak = rows[near], keys[near], tiebreak[near]
+        page = rows[np.lexsort((tiebreak, keys))[skip:end]]
+        return [view.books[row] for row in page.tolist()]
+
+
+# FTS5 trigram index over titles and authors, kept in step by triggers so a
+# search never scans the books table. Needs SQLite 3.34 or newer.
+FTS_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(title, author, tokenize='trigram')",
+    """CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN
+        INSERT INTO books_fts(rowid, title, author)
+        VALUES (new.key, json_extract(new.value, '$.title'), json_extract(new.value, '$.author'));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE ON books BEGIN
+        DELETE FROM books_fts WHERE rowid = old.key;
+        INSERT INTO books_fts(rowid, title, author)
+        VALUES (new.key, json_extract(new.value, '$.title'), json_extract(new.value, '$.author'));
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN
+        DELETE FROM books_fts WHERE rowid = old.key;
+    END""",
+]
+
+HAS_FTS_TRIGRAM = sqlite3.sqlite_version_info >= (3, 34)
+
+
+class SqliteCatalog:
+    """Books in a SQLite table with the filterable fields as indexed columns.
+
+    ``query`` turns the GET /books/ parameters into one parametrised SELECT,
+    so filtering, sorting and paging happen on indexes and only the rows of
+    the requested page are decoded. The table is seeded from ``seed_path``
+    on first start; afterwards the database is the source of truth.
+    """
+
+    def __init__(self, path, seed_path=None):
+        self.store = SqliteStore(
+            path, "books", key_type="INTEGER",
+            columns={
+                "isbn": "TEXT",
+                "programming_language": "TEXT",
+                "publisher": "TEXT COLLATE NOCASE",
+                "price": "REAL",
+                "publication_year": "INTEGER",
+            },
+            extra_schema=FTS_SCHEMA if HAS_FTS_TRIGRAM else (),
+            seed_path=seed_path, seed_key="id",
+        )
+        self._add_lock = threading.Lock()
+
+    @property
+    def stamp(self):
+        return self.store.stamp
+
+    def load(self):
+        self.store.load()
+
+    def __len__(self):
+        return len(self.store)
+
+    def get_by_id(self, book_id):
+        return self.store.get(book_id)
+
+    def get_by_isbn(self, isbn):
+        books = self.store.query(["isbn = ?"], (isbn,), limit=1)
+        return books[0] if books else None
+
+    def search(self, text):
+        return self.query(search=text, sort_field=None, limit=None)
+
+    def query(self, search=None, programming_languages=(), publisher=None, min_price=None, max_price=None,
+              sort_field="price", descending=False, skip=0, limit=10, after=None):
+        """One page of books matching the filters, ordered by (``sort_field``, id).
+
+        ``after`` becomes a row-value condition on the (field, key) index,
+        so any page costs the same as the first.
+        """
+        where, params = [], []
+        if search:
+            if HAS_FTS_TRIGRAM and len(search) >= NGRAM:
+                where.append("key IN (SELECT rowid FROM books_fts WHERE books_fts MATCH ?)")
+                params.append('"' + search.replace('"', '""') + '"')
+            else:
+                where.append("(instr(lower(json_extract(value, '$.title')), ?) "
+                             "OR instr(lower(json_extract(value, '$.author')), ?))")
+                params += [search.lower(), search.lower()]
+        if programming_languages:
+            where.append(f"programming_language IN ({', '.join('?' * len(programming_languages))})")
+            params += programming_languages
+        if publisher:
+            where.append("publisher = ?")
+            params.append(publisher)
+        if min_price is not None:
+            where.append("price >= ?")
+            params.append(min_price)
+        if max_price is not None:
+            where.append("price <= ?")
+            params.append(max_price)
+        if sort_field is None:
+            order_by = "key"
+        elif sort_field in SORT_FIELDS:
+            direction = "DESC" if descending else "ASC"
+            order_by = f"{sort_field} {direction}, key {direction}"
+            if after is not None:
+                where.append(f"({sort_field}, key) {'<' if descending else '>'} (?, ?)")
+                params += list(after)
+        else:
+            raise ValueError(f"Cannot sort by {sort_field!r}")
+        return self.store.query(where, params, order_by=order_by, limit=limit, offset=skip)
+
+    def add(self, fields):
+        """Insert ``fields`` as a new book with the next free id."""
+        with self._add_lock:
+            if self.get_by_isbn(fields["isbn"]) is not None:
+                raise ExistsError(fields["isbn"])
+            last = self.store.query(order_by="key DESC", limit=1)
+            book = {"id": last[0]["id"] + 1 if last else 1, **fields}
+            self.store.put(book["id"], book)
+        return book
+
+    async def aload(self):
+        return await run_io(self.load)
+
+    async def aadd(self, fields):
+        return await run_io(self.add, fields)
+
+    def close(self):
+        self.store.close()
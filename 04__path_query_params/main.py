@@ -1,11 +1,18 @@
 from fastapi import FastAPI, Path, HTTPException, Query
 import json
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from common.responses import FastJSONResponse
 
 def load_data():
     with open('patients.json', 'r') as f:
         return json.load(f)
 
-app = FastAPI()
+# responses are encoded with orjson when it is installed
+app = FastAPI(default_response_class=FastJSONResponse)
 
 @app.get("/")
 async def hello():
@@ -3,6 +3,12 @@ from fastapi.responses import JSONResponse
 import json
 from pydantic import BaseModel, Field, computed_field
 from typing import Annotated, Literal
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from common.responses import FastJSONResponse
 
 
 
@@ -51,7 +57,8 @@ def save_data(data):
 
 
 
-app = FastAPI()
+# responses are encoded with orjson when it is installed
+app = FastAPI(default_response_class=FastJSONResponse)
 
 @app.get("/")
 async def hello():
@@ -1,8 +1,26 @@
-from fastapi import FastAPI, Path, HTTPException, Query
-from fastapi.responses import JSONResponse
-import json
-from pydantic import BaseModel, Field, computed_field
-from typing import Annotated, Literal, Optional
+from fastapi import Body, Depends, FastAPI, Header, Path, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, Response
+from contextlib import asynccontextmanager
+from pydantic import BaseModel, Field, ValidationError, computed_field
+from typing import Annotated, Any, List, Literal, Optional
+import os
+import pathlib
+import sys
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from common.bulk import apply_batch, item_result, validate_items
+from common.indexes import SortedIndex
+from common.metrics import install_metrics, timed
+from common.mmapstore import INTERNED, MmapStore
+from common.records import CompactRecord, freeze_heap
+from common.responses import (
+    BodyCache, FastJSONResponse, conditional_headers, dumps, json_response, not_modified, parse_etags,
+)
+from common.shared import SharedJsonStore, catch_up
+from common.sqlite import SqliteStore
+from common.store import ABSENT, ExistsError, JsonStore, WalStore
+from common.watch import FileWatcher
 
 
 
@@ -50,31 +68,74 @@ class UpdatePatient(BaseModel):
     weight: Annotated[Optional[float], Field(default=None, gt=0)]
 
 
+# One item of the bulk edit endpoint: patient id plus the fields to change
 
+class BulkUpdatePatient(UpdatePatient):
 
+    id: Annotated[str, Field(..., description="Id of the patient to update")]
 
-# Utility functions
 
-def load_data():
-    try:
-        with open('patients.json', 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}  # Return empty dict if file doesn't exist
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=500, detail="Invalid JSON in patients.json")
 
 
-def save_data(data):
-    try:
-        with open('patients.json', 'w') as f:
-            json.dump(data, f, indent=2)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to save data: {str(e)}")
 
+# Resident patient store: loaded once at startup, written through on every change.
+# PATIENT_STORE=sqlite keeps the records in patients.db instead, seeded from
+# patients.json on first start; PATIENT_STORE=mmap keeps them as fixed-width
+# binary records in patients.bin, read and updated in place, by a single worker
+# process only. PATIENT_STORE=shared keeps patients.json consistent across
+# worker processes (uvicorn --workers N).
+STORE_MODE = os.getenv("PATIENT_STORE", "json")
+
+SORT_FIELDS = ['height', 'weight', 'bmi']
+
+
+# resident form of a stored patient (Patient.model_dump() without the id);
+# measurements are rounded, so they repeat as much as cities do
+class PatientRecord(CompactRecord):
+    __slots__ = ('name', 'city', 'age', 'gender', 'height', 'weight', 'bmi', 'verdict')
+    INTERNED = ('city', 'gender', 'height', 'weight', 'bmi', 'verdict')
+
+
+# slot layout of patients.bin; city, gender and verdict repeat a lot, so they
+# are stored as codes into a string table
+PATIENT_LAYOUT = [
+    ('name', '64s'), ('city', INTERNED), ('age', 'h'), ('gender', INTERNED),
+    ('height', 'd'), ('weight', 'd'), ('bmi', 'd'), ('verdict', INTERNED),
+]
+
+# one sorted view per sortable field, kept in step by the store
+sort_indexes = [SortedIndex(field) for field in SORT_FIELDS]
+
+if STORE_MODE == "sqlite":
+    store = SqliteStore('patients.db', 'patients', indexes=sort_indexes, seed_path='patients.json')
+elif STORE_MODE == "mmap":
+    store = MmapStore('patients.bin', PATIENT_LAYOUT, indexes=sort_indexes, seed_path='patients.json')
+elif STORE_MODE == "shared":
+    store = SharedJsonStore('patients.json', indexes=sort_indexes, record_type=PatientRecord)
+else:
+    store = JsonStore('patients.json', indexes=sort_indexes, record_type=PatientRecord)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await store.aload()
+    freeze_heap()
+    # hand edits of patients.json are picked up without a restart
+    # (a WalStore cannot merge them with its log)
+    watchable = isinstance(store, JsonStore) and not isinstance(store, WalStore)
+    watcher = FileWatcher(store).start() if watchable else None
+    yield
+    if watcher is not None:
+        watcher.stop()
+    store.close()
 
 
-app = FastAPI()
+# with several workers, what the others wrote is loaded before each request
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse,
+              dependencies=[Depends(catch_up(store))] if STORE_MODE == "shared" else [])
+
+# request counts, latency histograms and stage timings at /metrics
+metrics = install_metrics(app)
 
 @app.get("/")
 async def hello():
@@ -87,16 +148,29 @@ async def about():
 
 
 
+# encoded /view body, rebuilt only when the store version changes
+view_body = BodyCache()
+
+
 @app.get('/view')
-async def view():
-    return load_data()
+async def view(request: Request):
+    # validators are taken before the read, so they are never newer than the body
+    headers = conditional_headers(store.stamp)
+    unchanged = not_modified(request, headers)
+    if unchanged is not None:
+        return unchanged
+    with timed('serialization'):
+        body = view_body.get(headers['ETag'], lambda: dumps(dict(store.items())))
+    return Response(content=body, media_type='application/json', headers=headers)
 
 
 @app.get('/patient/{patient_id}/')
-def view_patient(patient_id:str = Path(..., description="Id of the patients in DB", example="P001")):
-    data = load_data()
-    if patient_id in data:
-        return data[patient_id]
+def view_patient(response: Response, patient_id:str = Path(..., description="Id of the patients in DB", example="P001")):
+    patient, etag = store.get_with_etag(patient_id)
+    if patient is not None:
+        # send this back in If-Match to update only the version you read
+        response.headers['ETag'] = etag
+        return patient
     
     raise HTTPException(status_code=404, detail="Patient not found")
 
@@ -104,73 +178,147 @@ def view_patient(patient_id:str = Path(..., description="Id of the patients in D
 
 
 @app.get('/sort')
-def sort(sort_by: str = Query(..., description="Sort the patient data based on hieght, weight, bmi"), order:str = Query('asc', description='Sort accoding to asc or desc order')):
-    valid_fields = ['height', 'weight', 'bmi']
+def sort(sort_by: str = Query(..., description="Sort the patient data based on hieght, weight, bmi"), order:str = Query('asc', description='Sort accoding to asc or desc order'),
+         limit: Optional[int] = Query(None, ge=1, description="Maximum number of patients to return"),
+         offset: int = Query(0, ge=0, description="Number of patients to skip")):
+    valid_fields = SORT_FIELDS
     if sort_by not in valid_fields:
         raise HTTPException(status_code=400, detail=f"Invalid filed selected from {valid_fields}")
     
     if order not in ['asc', 'desc']:
         raise HTTPException(status_code=404, detail="Invalid order seleted between asc and desc")
 
-    data = load_data()
-
     sort_order = True if order=='desc' else False
 
-    sorted_data = sorted(data.values(), key=lambda x: x.get(sort_by, 0), reverse=sort_order)
+    # walk the maintained index instead of sorting every patient
+    sorted_data = store.sorted_records(sort_by, reverse=sort_order, offset=offset, limit=limit)
 
-    return sorted_data
+    return json_response(sorted_data)
 
 
 
 
 @app.post('/create')
-def create_patient(patient: Patient):
+async def create_patient(patient: Patient):
 
-    # load existing data
-    data = load_data()
-    # Check if the patient already exist
-    if patient.id in data:
+    # new patient add to the store, written through to the json file; the
+    # store checks the patient does not exist yet as part of the write
+    try:
+        await store.ainsert(patient.id, patient.model_dump(exclude={'id'}))
+    except ExistsError:
         raise HTTPException(status_code=400, detail='Patient already exists')
-    
-    # new patient add to the database
-    data[patient.id] = patient.model_dump(exclude={'id'})
-
-    # save the data into json file
-    save_data(data)
 
     return JSONResponse(status_code=201, content={'messge': "Patient created successful"})
 
 
 
 
+# Bulk endpoints: the whole batch is checked, saved with a single write and
+# answered with one result per item. atomic=true applies all items or none.
 
-@app.put('/edit/{patient_id}')
-def update_patient(patient_id: str, patient_update: UpdatePatient):
+@app.post('/create/bulk')
+async def bulk_create_patients(patients: Annotated[List[Any], Body(..., description="Patient objects, validated one by one")],
+                               atomic: bool = Query(True, description="Apply all items or none")):
+
+    results, changes = [], []
+    seen = set()
+    for _, patient in validate_items(Patient, patients, results):
+        if patient.id in store or patient.id in seen:
+            results.append(item_result(patient.id, 400, 'Patient already exists'))
+            continue
+        seen.add(patient.id)
+        changes.append((patient.id, patient.model_dump(exclude={'id'})))
+        results.append(item_result(patient.id, 201))
+
+    # the store checks again under its lock that no one created them meanwhile
+    expected = {patient_id: ABSENT for patient_id, _ in changes}
+    return await apply_batch(store, changes, results, atomic, success_status=201, expected=expected)
 
-    data = load_data()
 
-    if patient_id not in data:
+@app.put('/edit/bulk')
+async def bulk_update_patients(patient_updates: Annotated[List[Any], Body(..., description="Patient ids and fields to change, validated one by one")],
+                               atomic: bool = Query(True, description="Apply all items or none")):
+
+    results, pending, expected = [], {}, {}
+    for _, patient_update in validate_items(BulkUpdatePatient, patient_updates, results):
+        current = pending.get(patient_update.id)
+        if current is None:
+            # the revision read is checked at the write, so a concurrent edit is not lost
+            current, expected[patient_update.id] = store.get_with_revision(patient_update.id)
+        if current is None:
+            results.append(item_result(patient_update.id, 404, 'Patient not found'))
+            continue
+        # merge the changes and let the Patient model recompute bmi + verdict
+        updated_patient_info = {**current, **patient_update.model_dump(exclude_unset=True)}
+        try:
+            with timed('validation'):
+                patient_pydandic_obj = Patient(**updated_patient_info)
+        except ValidationError as e:
+            results.append(item_result(patient_update.id, 422, e.errors(include_url=False)))
+            continue
+        pending[patient_update.id] = patient_pydandic_obj.model_dump(exclude={'id'})
+        results.append(item_result(patient_update.id, 200))
+
+    return await apply_batch(store, list(pending.items()), results, atomic, expected=expected)
+
+
+@app.delete('/delete/bulk')
+async def bulk_delete_patients(patient_ids: Annotated[List[str], Body(...)], atomic: bool = Query(True, description="Apply all items or none")):
+
+    results, changes = [], []
+    seen = set()
+    for patient_id in patient_ids:
+        if patient_id not in store or patient_id in seen:
+            results.append(item_result(patient_id, 404, 'Patient not found'))
+            continue
+        seen.add(patient_id)
+        changes.append((patient_id, None))
+        results.append(item_result(patient_id, 200))
+
+    return await apply_batch(store, changes, results, atomic)
+
+
+
+
+
+@app.put('/edit/{patient_id}')
+async def update_patient(patient_id: str, patient_update: UpdatePatient,
+                         if_match: Optional[str] = Header(None, description="ETag of the patient as last read; 409 if it changed since")):
+
+    if patient_id not in store:
         raise HTTPException(status_code=404, detail='Patient not found')
-    
-    existing_patient_info = data[patient_id]
 
     updated_patient_info = patient_update.model_dump(exclude_unset=True)
 
-    for key, value in updated_patient_info.items():
-        existing_patient_info[key] = value
+    # runs on a copy of the stored record, again if someone else saved it first
+    def apply_update(existing_patient_info):
+        for key, value in updated_patient_info.items():
+            existing_patient_info[key] = value
+
+        #existing_patient_info -> pydantic object -> updated bmi + verdict
+        existing_patient_info['id'] = patient_id
+        with timed('validation'):
+            patient_pydandic_obj = Patient(**existing_patient_info)
+        #-> pydantic object -> dict
+        return patient_pydandic_obj.model_dump(exclude={'id'})
+
+    # read-modify-write holding only this patient's lock
+    try:
+        _, etag = await store.aupdate(patient_id, apply_update, if_match=parse_etags(if_match))
+    except KeyError:
+        raise HTTPException(status_code=404, detail='Patient not found')
+
+    return JSONResponse(status_code=200, content={'message':'patient updated'}, headers={'ETag': etag})
 
-    #existing_patient_info -> pydantic object -> updated bmi + verdict
-    existing_patient_info['id'] = patient_id
-    patient_pydandic_obj = Patient(**existing_patient_info)
-    #-> pydantic object -> dict
-    existing_patient_info = patient_pydandic_obj.model_dump(exclude={'id'})
 
-    # add this dict to data
-    data[patient_id] = existing_patient_info
 
-    # save data
-    save_data(data)
 
-    return JSONResponse(status_code=200, content={'message':'patient updated'})
+@app.delete('/delete/{patient_id}')
+async def delete_patient(patient_id: str):
 
+    if patient_id not in store:
+        raise HTTPException(status_code=404, detail='Patient not found')
+    
+    await store.adelete(patient_id)
 
+    return JSONResponse(status_code=200, content={'message':'patient deleted'})
@@ -1,65 +1,187 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, Field, computed_field, EmailStr
-from typing import Annotated, Optional
-import json
-from datetime import date, datetime
+from fastapi import Body, Depends, FastAPI, Header, HTTPException, Query, Request
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError, computed_field, EmailStr
+from typing import Annotated, Any, List, Literal, Optional
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
 from decimal import Decimal
-from fastapi.responses import JSONResponse
+from functools import cached_property
+from fastapi.responses import JSONResponse, Response
+import os
+import pathlib
+import sys
+import threading
+import time
 
-# Initialize FastAPI app
-app = FastAPI(title="Employee Records Management API")
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[2]))
+
+from common.bulk import apply_batch, item_result, validate_items
+from common.metrics import install_metrics, timed
+from common.records import CompactRecord, freeze_heap
+from common.responses import (
+    BodyCache, FastJSONResponse, conditional_headers, json_response, not_modified, parse_etags, stream_records,
+)
+from common.shards import ShardedStore
+from common.shared import SharedJsonStore, catch_up
+from common.sqlite import SqliteStore
+from common.store import ABSENT, ExistsError, JsonStore, WalStore
+
+# Storage settings: "json" rewrites employees.json on every change, "wal"
+# appends one record per change to employees.json.log and compacts it in the
+# background once it passes EMPLOYEE_WAL_COMPACT_BYTES; "sqlite" keeps one
+# row per employee in employees.db, seeded from employees.json on first start;
+# "shared" rewrites employees.json like "json" but stays consistent across
+# several worker processes (uvicorn --workers N).
+STORE_MODE = os.getenv("EMPLOYEE_STORE", "json")
+WAL_COMPACT_BYTES = int(os.getenv("EMPLOYEE_WAL_COMPACT_BYTES", 1024 * 1024))
+# EMPLOYEE_SHARDS > 1 splits the json, wal and shared stores into that many files,
+# employees.<i>-of-<n>.json, picked by a hash of the employee ID and seeded
+# from employees.json on first start.
+SHARDS = int(os.getenv("EMPLOYEE_SHARDS", 1))
+# Employees whose rendered computed fields are kept; the least recently
+# rendered are dropped first. Repeated full lists come from the body cache.
+DERIVED_CACHE_SIZE = int(os.getenv("EMPLOYEE_DERIVED_CACHE_SIZE", 4096))
+
+# Employee IDs are "E" and 3 to EMPLOYEE_ID_DIGITS digits, so E001 stays valid
+# next to E1000 or E000123456
+EMPLOYEE_ID_DIGITS = int(os.getenv("EMPLOYEE_ID_DIGITS", 9))
+EMPLOYEE_ID_PATTERN = f"^E[0-9]{{3,{EMPLOYEE_ID_DIGITS}}}$"
+
+def employee_id_order(employee_id: str) -> tuple:
+    """Sort key in numeric order: E999, E1000, E001000."""
+    digits = employee_id[1:].lstrip("0")
+    return (len(digits), digits, employee_id)
 
 # Pydantic model for Employee with raw and computed fields
 class Employee(BaseModel):
-    id: Annotated[str, Field(..., description="Unique ID of the employee, e.g., E001", pattern="^E[0-9]{3}$")]
+    id: Annotated[str, Field(..., description="Unique ID of the employee, e.g., E001 or E1000", pattern=EMPLOYEE_ID_PATTERN)]
     name: Annotated[str, Field(..., min_length=1, description="Name of the employee")]
     email: Annotated[EmailStr, Field(..., description="Email of the employee")]
     department: Annotated[str, Field(..., min_length=1, description="Department of the employee")]
     date_joined: Annotated[date, Field(..., description="Date the employee joined")]
     salary: Annotated[Decimal, Field(..., gt=0, decimal_places=2, description="Salary of the employee")]
 
+    @cached_property
+    def _derived(self) -> dict:
+        return derived_cache.get(self)
+
     @computed_field
     def name_upper(self) -> str:
         """Convert name to uppercase."""
-        return self.name.upper()
+        return self._derived["name_upper"]
 
     @computed_field
     def email_masked(self) -> str:
         """Mask the email for privacy."""
-        parts = self.email.split('@')
-        return f"{parts[0][:2]}***@{parts[1]}" if len(parts) > 1 else self.email
+        return self._derived["email_masked"]
 
     @computed_field
     def name_reversed(self) -> str:
         """Reverse the name string."""
-        return self.name[::-1]
+        return self._derived["name_reversed"]
 
     @computed_field
     def department_title(self) -> str:
         """Convert department to title case."""
-        return self.department.title()
+        return self._derived["department_title"]
 
     @computed_field
     def date_joined_formatted(self) -> str:
         """Format date as DD-MM-YYYY."""
-        return self.date_joined.strftime("%d-%m-%Y")
+        return self._derived["date_joined_formatted"]
 
     @computed_field
     def salary_with_currency(self) -> str:
         """Add currency symbol to salary."""
-        return f"₹{self.salary}"
+        return self._derived["salary_with_currency"]
 
     @computed_field
     def time_since_joined(self) -> str:
         """Approximate time since the date joined."""
-        delta = datetime.now().date() - self.date_joined
-        days = delta.days
-        if days < 30:
-            return f"{days} days"
-        elif days < 365:
-            return f"{days // 30} months"
-        else:
-            return f"{days // 365} years"
+        return derived_cache.time_since_joined(self)
+
+def render_derived_fields(employee: Employee) -> dict:
+    """Render the date-independent computed fields of an employee."""
+    parts = employee.email.split('@')
+    return {
+        "name_upper": employee.name.upper(),
+        "email_masked": f"{parts[0][:2]}***@{parts[1]}" if len(parts) > 1 else employee.email,
+        "name_reversed": employee.name[::-1],
+        "department_title": employee.department.title(),
+        "date_joined_formatted": employee.date_joined.strftime("%d-%m-%Y"),
+        "salary_with_currency": f"₹{employee.salary}",
+    }
+
+def format_time_since(date_joined: date, today: date) -> str:
+    days = (today - date_joined).days
+    if days < 30:
+        return f"{days} days"
+    elif days < 365:
+        return f"{days // 30} months"
+    else:
+        return f"{days // 365} years"
+
+# Per-employee cache of rendered computed fields
+class DerivedFieldCache:
+    """Rendered computed fields per employee id.
+
+    An entry is reused until one of the employee's source fields changes;
+    ``time_since_joined`` is additionally keyed on the current day, which is
+    looked up once per day instead of once per record. At most ``maxsize``
+    employees are kept, so a full export does not hold a copy of every one.
+    """
+
+    def __init__(self, maxsize=DERIVED_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._today = None
+        self._today_ends = 0.0
+
+    def today(self) -> date:
+        now = time.time()
+        if now >= self._today_ends:
+            self._today = date.today()
+            tomorrow = datetime.combine(self._today + timedelta(days=1), datetime.min.time())
+            self._today_ends = tomorrow.timestamp()
+        return self._today
+
+    def _entry(self, employee: Employee) -> dict:
+        source = (employee.name, employee.email, employee.department, employee.date_joined, employee.salary)
+        with self._lock:
+            entry = self._entries.get(employee.id)
+            if entry is not None and entry["source"] == source:
+                self._entries.move_to_end(employee.id)
+                return entry
+        entry = {"source": source, "fields": render_derived_fields(employee), "day": None, "since": None}
+        if self.maxsize > 0:
+            with self._lock:
+                self._entries[employee.id] = entry
+                self._entries.move_to_end(employee.id)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def get(self, employee: Employee) -> dict:
+        return self._entry(employee)["fields"]
+
+    def time_since_joined(self, employee: Employee) -> str:
+        entry = self._entry(employee)
+        today = self.today()
+        if entry["day"] != today:
+            entry["since"] = format_time_since(employee.date_joined, today)
+            entry["day"] = today
+        return entry["since"]
+
+    def invalidate(self, employee_id: str):
+        with self._lock:
+            self._entries.pop(employee_id, None)
+
+    def day_started(self) -> float:
+        """Timestamp of the local midnight that began the current day."""
+        return datetime.combine(self.today(), datetime.min.time()).timestamp()
+
+derived_cache = DerivedFieldCache()
 
 # Pydantic model for updating employee data (partial updates)
 class UpdateEmployee(BaseModel):
@@ -69,22 +191,53 @@ class UpdateEmployee(BaseModel):
     date_joined: Annotated[Optional[date], Field(None)]
     salary: Annotated[Optional[Decimal], Field(None, gt=0, decimal_places=2)]
 
-# Utility functions for JSON file handling
-def load_data():
-    try:
-        with open('employees.json', 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
-    except json.JSONDecodeError:
-        raise HTTPException(status_code=500, detail="Invalid JSON in employees.json")
-
-def save_data(data):
-    try:
-        with open('employees.json', 'w') as f:
-            json.dump(data, f, indent=2)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to save data: {str(e)}")
+# Built once and reused: validates and serialises a whole list of employees
+# inside pydantic-core instead of one Employee(...) call per record
+employee_list_adapter = TypeAdapter(List[Employee])
+
+# One item of a bulk update: the employee ID plus the fields to change
+class BulkEmployeeUpdate(UpdateEmployee):
+    id: Annotated[str, Field(..., description="ID of the employee to update")]
+
+# Resident form of a stored employee, see employee_record
+class EmployeeRecord(CompactRecord):
+    __slots__ = ('name', 'email', 'department', 'date_joined', 'salary')
+    INTERNED = ('department', 'date_joined')
+
+# Resident employee store, loaded once at startup; a sharded one lists
+# employees in ID order
+SHARD_TYPES = {"json": JsonStore, "wal": WalStore, "shared": SharedJsonStore}
+if SHARDS > 1 and STORE_MODE in SHARD_TYPES:
+    store = ShardedStore('employees.json', SHARDS, shard_type=SHARD_TYPES[STORE_MODE],
+                         order=employee_id_order, record_type=EmployeeRecord,
+                         **({'compact_threshold': WAL_COMPACT_BYTES} if STORE_MODE == "wal" else {}))
+elif STORE_MODE == "wal":
+    store = WalStore('employees.json', compact_threshold=WAL_COMPACT_BYTES, record_type=EmployeeRecord)
+elif STORE_MODE == "sqlite":
+    store = SqliteStore('employees.db', 'employees', seed_path='employees.json')
+elif STORE_MODE == "shared":
+    store = SharedJsonStore('employees.json', record_type=EmployeeRecord)
+else:
+    store = JsonStore('employees.json', record_type=EmployeeRecord)
+
+def employee_record(employee: Employee) -> dict:
+    """Stored form of an employee: raw fields only, as JSON-ready values."""
+    return employee.model_dump(mode='json', include=set(UpdateEmployee.model_fields))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await store.aload()
+    freeze_heap()
+    yield
+    store.close()
+
+# Initialize FastAPI app
+# with several workers, what the others wrote is loaded before each request
+app = FastAPI(title="Employee Records Management API", lifespan=lifespan, default_response_class=FastJSONResponse,
+              dependencies=[Depends(catch_up(store))] if STORE_MODE == "shared" else [])
+
+# request counts, latency histograms and stage timings at /metrics
+metrics = install_metrics(app)
 
 # API Endpoints
 @app.get("/", summary="Welcome Message")
@@ -95,52 +248,155 @@ async def hello():
 async def about():
     return {"message": "A fully functional API to manage employee records with formatted data."}
 
+def iter_employee_json(items):
+    """Validate and serialise one employee at a time."""
+    for emp_id, emp in items:
+        yield Employee(**emp, id=emp_id).model_dump_json().encode()
+
+def build_employee_list() -> bytes:
+    """Validate every stored employee and serialise the whole list in one pass."""
+    with timed("validation"):
+        employees = employee_list_adapter.validate_python([{**emp, "id": emp_id} for emp_id, emp in store.items()])
+    # computed fields are rendered here, so they show up as serialization time
+    with timed("serialization"):
+        return employee_list_adapter.dump_json(employees)
+
+# encoded /employees body, rebuilt only when its ETag changes
+employee_list_body = BodyCache()
+
 @app.get("/employees", summary="List All Employees")
-async def list_employees():
-    data = load_data()
-    employees = [Employee(**emp, id=emp_id) for emp_id, emp in data.items()]
-    return employees
+async def list_employees(
+    request: Request,
+    stream: Optional[Literal["ndjson", "json"]] = Query(None, description="Stream employees as NDJSON or a chunked JSON array instead of one response body"),
+):
+    # time_since_joined changes at midnight, so the day is part of the version
+    headers = conditional_headers(
+        store.stamp, derived_cache.today().isoformat(),
+        last_modified=max(store.stamp.last_modified, derived_cache.day_started()),
+    )
+    unchanged = not_modified(request, headers)
+    if unchanged is not None:
+        return unchanged
+    if stream:
+        return stream_records(iter_employee_json(store.items()), stream, headers=headers)
+    body = employee_list_body.get(headers["ETag"], build_employee_list)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @app.get("/employees/{employee_id}", summary="Get Employee by ID")
 async def get_employee(employee_id: str):
-    data = load_data()
-    if employee_id not in data:
+    record, etag = store.get_with_etag(employee_id)
+    if record is None:
         raise HTTPException(status_code=404, detail="Employee not found")
-    employee = Employee(**data[employee_id], id=employee_id)
-    return employee
+    with timed("validation"):
+        employee = Employee(**record, id=employee_id)
+    # send the ETag back in If-Match to update only the version you read
+    return json_response(employee, headers={"ETag": etag})
 
 @app.post("/employees", summary="Create Employee", status_code=201)
 async def create_employee(employee: Employee):
-    data = load_data()
-    if employee.id in data:
+    # the store checks the ID is free as part of the write, under its lock
+    try:
+        await store.ainsert(employee.id, employee_record(employee))
+    except ExistsError:
         raise HTTPException(status_code=400, detail="Employee already exists")
-    data[employee.id] = employee.model_dump(exclude={'id'})
-    save_data(data)
     return JSONResponse(status_code=201, content={"message": "Employee created successfully"})
 
+# Bulk endpoints: validate the whole batch, persist once, report per item.
+# With atomic=true (default) any failing item means nothing is applied.
+@app.post("/employees/bulk", summary="Create Employees in Bulk")
+async def bulk_create_employees(employees: Annotated[List[Any], Body(..., description="Employee objects, validated one by one")],
+                                atomic: bool = Query(True, description="Apply all items or none")):
+    results, changes = [], []
+    seen = set()
+    for _, employee in validate_items(Employee, employees, results):
+        if employee.id in store or employee.id in seen:
+            results.append(item_result(employee.id, 400, "Employee already exists"))
+            continue
+        seen.add(employee.id)
+        changes.append((employee.id, employee_record(employee)))
+        results.append(item_result(employee.id, 201))
+    # the store checks again under its lock that no one created them meanwhile
+    expected = {employee_id: ABSENT for employee_id, _ in changes}
+    return await apply_batch(store, changes, results, atomic, success_status=201, expected=expected)
+
+@app.put("/employees/bulk", summary="Update Employees in Bulk")
+async def bulk_update_employees(updates: Annotated[List[Any], Body(..., description="Employee IDs and fields to change, validated one by one")],
+                                atomic: bool = Query(True, description="Apply all items or none")):
+    results, pending, expected = [], {}, {}
+    for _, update in validate_items(BulkEmployeeUpdate, updates, results):
+        current = pending.get(update.id)
+        if current is None:
+            # the revision read is checked at the write, so a concurrent edit is not lost
+            current, expected[update.id] = store.get_with_revision(update.id)
+        if current is None:
+            results.append(item_result(update.id, 404, "Employee not found"))
+            continue
+        merged = {**current, **update.model_dump(exclude_unset=True)}
+        try:
+            with timed("validation"):
+                updated_employee = Employee(**merged)
+        except ValidationError as e:
+            results.append(item_result(update.id, 422, e.errors(include_url=False)))
+            continue
+        pending[update.id] = employee_record(updated_employee)
+        results.append(item_result(update.id, 200))
+    response = await apply_batch(store, list(pending.items()), results, atomic, expected=expected)
+    if response.status_code != 409:
+        for employee_id in pending:
+            derived_cache.invalidate(employee_id)
+    return response
+
+@app.delete("/employees/bulk", summary="Delete Employees in Bulk")
+async def bulk_delete_employees(employee_ids: Annotated[List[str], Body(...)], atomic: bool = Query(True, description="Apply all items or none")):
+    results, changes = [], []
+    seen = set()
+    for employee_id in employee_ids:
+        if employee_id not in store or employee_id in seen:
+            results.append(item_result(employee_id, 404, "Employee not found"))
+            continue
+        seen.add(employee_id)
+        changes.append((employee_id, None))
+        results.append(item_result(employee_id, 200))
+    response = await apply_batch(store, changes, results, atomic)
+    if response.status_code != 409:
+        for employee_id in seen:
+            derived_cache.invalidate(employee_id)
+    return response
+
 @app.put("/employees/{employee_id}", summary="Update Employee")
-async def update_employee(employee_id: str, employee_update: UpdateEmployee):
-    data = load_data()
-    if employee_id not in data:
+async def update_employee(
+    employee_id: str,
+    employee_update: UpdateEmployee,
+    if_match: Optional[str] = Header(None, description="ETag of the employee as last read; 409 if it changed since"),
+):
+    if employee_id not in store:
         raise HTTPException(status_code=404, detail="Employee not found")
-    existing_employee = data[employee_id]
     update_data = employee_update.model_dump(exclude_unset=True)
-    for key, value in update_data.items():
-        existing_employee[key] = value
-    # Recreate Employee object to recompute fields
-    existing_employee['id'] = employee_id
-    updated_employee = Employee(**existing_employee)
-    data[employee_id] = updated_employee.model_dump(exclude={'id'})
-    save_data(data)
-    return JSONResponse(status_code=200, content={"message": "Employee updated successfully"})
+
+    # Runs on a copy of the stored record, again if another update won the race
+    def apply_update(existing_employee: dict) -> dict:
+        for key, value in update_data.items():
+            existing_employee[key] = value
+        # Recreate Employee object to recompute fields
+        existing_employee['id'] = employee_id
+        derived_cache.invalidate(employee_id)
+        with timed("validation"):
+            updated_employee = Employee(**existing_employee)
+        return employee_record(updated_employee)
+
+    # Read-modify-write holding only this employee's lock
+    try:
+        _, etag = await store.aupdate(employee_id, apply_update, if_match=parse_etags(if_match))
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Employee not found")
+    return JSONResponse(status_code=200, content={"message": "Employee updated successfully"}, headers={"ETag": etag})
 
 @app.delete("/employees/{employee_id}", summary="Delete Employee")
 async def delete_employee(employee_id: str):
-    data = load_data()
-    if employee_id not in data:
+    if employee_id not in store:
         raise HTTPException(status_code=404, detail="Employee not found")
-    del data[employee_id]
-    save_data(data)
+    await store.adelete(employee_id)
+    derived_cache.invalidate(employee_id)
     return JSONResponse(status_code=200, content={"message": "Employee deleted successfully"})
 
 
@@ -0,0 +1,7 @@
+"""In-process HTTP benchmarks for the example apps.
+
+Run from the repository root::
+
+    python -m benchmarks.run --sizes 1000 100000 --output before.json
+    python -m benchmarks.compare before.json after.json
+"""
@@ -0,0 +1,67 @@
+"""Minimal in-process ASGI client: no sockets, no extra dependencies."""
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from urllib.parse import urlencode
+
+
+class Response:
+    def __init__(self):
+        self.status = None
+        self.headers = []
+        self.body = bytearray()
+
+
+async def request(app, method, path, params=None, json_body=None, headers=()):
+    """Send one HTTP request straight into ``app`` and collect the response."""
+    body = b'' if json_body is None else json.dumps(json_body).encode()
+    raw_headers = [(b'host', b'bench'), (b'content-length', str(len(body)).encode())]
+    if json_body is not None:
+        raw_headers.append((b'content-type', b'application/json'))
+    raw_headers.extend((name.lower().encode(), value.encode()) for name, value in headers)
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path,
+        'raw_path': path.encode(),
+        'query_string': urlencode(params or {}, doseq=True).encode(),
+        'root_path': '',
+        'headers': raw_headers,
+        'client': ('127.0.0.1', 50000),
+        'server': ('bench', 80),
+        'state': {},
+    }
+    response = Response()
+    done = asyncio.Event()
+    sent_body = False
+
+    async def receive():
+        nonlocal sent_body
+        if not sent_body:
+            sent_body = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        await done.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response.status = message['status']
+            response.headers = message.get('headers', [])
+        elif message['type'] == 'http.response.body':
+            response.body += message.get('body', b'')
+            if not message.get('more_body', False):
+                done.set()
+
+    await app(scope, receive, send)
+    done.set()
+    return response
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """Run the app's startup and shutdown hooks around a benchmark."""
+    async with app.router.lifespan_context(app):
+        yield
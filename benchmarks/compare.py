@@ -0,0 +1,57 @@
+"""Diff two benchmark result files and flag regressions.
+
+    python -m benchmarks.compare before.json after.json --threshold 0.10
+
+Exits with status 1 if any (app, endpoint, size) got slower at p50 or p99
+by more than the threshold.
+"""
+import argparse
+import json
+import sys
+
+
+METRICS = ['throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms']
+
+
+def load(path):
+    with open(path) as f:
+        report = json.load(f)
+    return {(r['app'], r['endpoint'], r['size']): r for r in report['results']}
+
+
+def change(before, after):
+    if not before or before is None or after is None:
+        return None
+    return (after - before) / before
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=0.10, help="relative slowdown counted as a regression")
+    args = parser.parse_args(argv)
+
+    before, after = load(args.before), load(args.after)
+    regressions = 0
+    print(f"{'app':14} {'endpoint':28} {'size':>8}  " + '  '.join(f"{m:>22}" for m in METRICS))
+    for key in sorted(before.keys() & after.keys(), key=lambda k: (k[2], k[0], k[1])):
+        cells = []
+        regressed = False
+        for metric in METRICS:
+            delta = change(before[key][metric], after[key][metric])
+            cells.append(f"{before[key][metric]!s:>8} -> {after[key][metric]!s:<8}"
+                         + ('' if delta is None else f"{delta:+.0%}").rjust(5))
+            # Higher latency or lower throughput is worse.
+            worse = delta if metric.endswith('_ms') else (None if delta is None else -delta)
+            if metric in ('p50_ms', 'p99_ms') and worse is not None and worse > args.threshold:
+                regressed = True
+        regressions += regressed
+        print(f"{key[0]:14} {key[1]:28} {key[2]:>8}  " + '  '.join(cells) + ('  REGRESSION' if regressed else ''))
+    for key in sorted(before.keys() ^ after.keys()):
+        print(f"{key[0]:14} {key[1]:28} {key[2]:>8}  only in {'before' if key in before else 'after'}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
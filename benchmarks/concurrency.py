@@ -0,0 +1,184 @@
+"""Concurrent updates: throughput, conflicts and lost updates.
+
+Several clients PUT at once through the in-process ASGI client, so store
+writes overlap on the I/O pool. The scenarios:
+
+``create``    every client adds new records;
+``distinct``  every client edits its own record;
+``same``      every client edits a different field of one shared record,
+              without preconditions, then the record is checked for lost
+              updates;
+``if-match``  as ``same``, but each edit is a GET followed by a PUT with
+              If-Match, retried after a 409.
+
+Scenarios an app has no endpoint for are skipped. Comparing a run with
+``STORE_GROUP_COMMIT=0`` shows what sharing file writes buys.
+
+Run with ``python -m benchmarks.concurrency``.
+"""
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from benchmarks import datasets
+from benchmarks.asgi import request
+from benchmarks.run import APPS, running_app, summarize
+
+
+# Per app: the request adding record i of client c; update URL and record
+# URL for an id, and one field per client for the shared-record scenarios,
+# each mapped to its value for round i.
+TARGETS = {
+    '07_patients': {
+        'create': lambda c, i: ('/create', {
+            'id': f"C{c:03d}-{i:06d}", 'name': 'Bench Patient', 'city': 'Pune', 'age': 30,
+            'gender': 'Female', 'height': 1.65, 'weight': 60.0,
+        }),
+        'record_id': datasets.patient_id,
+        'first_id': 1,
+        'update': lambda key: f"/edit/{key}",
+        'get': lambda key: f"/patient/{key}/",
+        'fields': {
+            'city': lambda i: f"City {i}",
+            'age': lambda i: 20 + i % 60,
+            'height': lambda i: round(1.5 + i % 40 / 100, 2),
+            'weight': lambda i: 50.0 + i % 40,
+            'name': lambda i: f"Name {i}",
+        },
+    },
+    'employee_mgmt': {
+        'create': lambda c, i: ('/employees', {
+            'id': f"E9{c:03d}{i:05d}", 'name': 'Bench Employee', 'email': f"bench{c}.{i}@example.com",
+            'department': 'Engineering', 'date_joined': '2024-01-15', 'salary': '50000.00',
+        }),
+        'record_id': datasets.employee_id,
+        'first_id': 0,
+        'update': lambda key: f"/employees/{key}",
+        'get': lambda key: f"/employees/{key}",
+        'fields': {
+            'name': lambda i: f"Name {i}",
+            'department': lambda i: f"Department {i}",
+            'email': lambda i: f"user{i}@example.com",
+        },
+    },
+    '04_books': {
+        'create': lambda c, i: ('/books/', {
+            'isbn': datasets.book_isbn(10_000_000 + c * 100_000 + i), 'title': 'Benchmarking Python',
+            'author': 'Bench Author', 'programming_language': 'Python', 'publisher': 'Manning',
+            'price': 42.0, 'publication_year': 2024,
+        }),
+    },
+}
+
+TARGETS['employee_mgmt_sharded'] = TARGETS['employee_mgmt']
+TARGETS['07_patients_shared'] = TARGETS['07_patients']
+
+SCENARIOS = ['create', 'distinct', 'same', 'if-match']
+
+
+def _header(response, name):
+    for key, value in response.headers:
+        if key.decode().lower() == name:
+            return value.decode()
+    return None
+
+
+async def _client(app, target, key, field, rounds, if_match, latencies, counts):
+    for i in range(rounds):
+        value = target['fields'][field](i)
+        t0 = time.perf_counter()
+        while True:
+            headers = ()
+            if if_match:
+                current = await request(app, 'GET', target['get'](key))
+                headers = (('If-Match', _header(current, 'etag')),)
+            response = await request(app, 'PUT', target['update'](key), json_body={field: value}, headers=headers)
+            if response.status == 409 and if_match:
+                counts['conflicts'] += 1
+                continue
+            break
+        latencies.append(time.perf_counter() - t0)
+        if response.status >= 400:
+            counts['errors'] += 1
+    return value
+
+
+async def _creator(app, target, client, rounds, latencies, counts):
+    for i in range(rounds):
+        path, body = target['create'](client, i)
+        t0 = time.perf_counter()
+        response = await request(app, 'POST', path, json_body=body)
+        latencies.append(time.perf_counter() - t0)
+        if response.status >= 400:
+            counts['errors'] += 1
+
+
+async def run_scenario(app, target, scenario, clients, rounds):
+    if scenario == 'create':
+        latencies, counts = [], {'errors': 0}
+        started = time.perf_counter()
+        await asyncio.gather(*(_creator(app, target, c, rounds, latencies, counts) for c in range(clients)))
+        stats = summarize(latencies, time.perf_counter() - started, counts['errors'])
+        return {**stats, 'clients': clients, 'conflicts': 0, 'lost_updates': 0}
+    fields = list(target['fields'])
+    if scenario != 'distinct':
+        clients = min(clients, len(fields))
+    shared = target['record_id'](target['first_id'])
+    latencies, counts = [], {'errors': 0, 'conflicts': 0}
+    jobs = []
+    for c in range(clients):
+        key = target['record_id'](target['first_id'] + c) if scenario == 'distinct' else shared
+        field = fields[0] if scenario == 'distinct' else fields[c]
+        jobs.append(_client(app, target, key, field, rounds, scenario == 'if-match', latencies, counts))
+    started = time.perf_counter()
+    last_values = await asyncio.gather(*jobs)
+    elapsed = time.perf_counter() - started
+    lost = 0
+    if scenario != 'distinct':
+        record = json.loads((await request(app, 'GET', target['get'](shared))).body)
+        lost = sum(record.get(field) != value for field, value in zip(fields, last_values))
+    stats = summarize(latencies, elapsed, counts['errors'])
+    return {**stats, 'clients': clients, 'conflicts': counts['conflicts'], 'lost_updates': lost}
+
+
+async def main_async(args):
+    results = []
+    for name in args.apps:
+        async with running_app(f"{name}_concurrency", APPS[name], args.size, args.data_dir) as (app, _):
+            for scenario in args.scenarios:
+                if ('create' if scenario == 'create' else 'update') not in TARGETS[name]:
+                    continue
+                stats = await run_scenario(app, TARGETS[name], scenario, args.clients, args.rounds)
+                results.append({'app': name, 'scenario': scenario, 'size': args.size, **stats})
+                print(f"{name:14} {scenario:9} clients={stats['clients']:<3} {stats['throughput_rps']:>9} upd/s  "
+                      f"p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms conflicts={stats['conflicts']} "
+                      f"lost={stats['lost_updates']} errors={stats['errors']}", flush=True)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--apps', nargs='+', default=list(TARGETS), choices=list(TARGETS))
+    parser.add_argument('--scenarios', nargs='+', default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument('--size', type=int, default=1_000, help="records in the dataset")
+    parser.add_argument('--clients', type=int, default=8, help="concurrent clients")
+    parser.add_argument('--rounds', type=int, default=25, help="updates per client")
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'fastapi-series-bench'),
+                        help="where generated datasets are cached between runs")
+    parser.add_argument('--output', default='bench_concurrency.json')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = asyncio.run(main_async(args))
+    with open(args.output, 'w') as f:
+        json.dump({'results': results}, f, indent=2)
+    print(f"wrote {len(results)} results to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Synthetic patients.json, books.json and employees.json of any size."""
+import json
+import os
+import random
+from datetime import date, timedelta
+
+
+CITIES = ['Mumbai', 'Delhi', 'Pune', 'Guwahati', 'Bengaluru', 'Chennai', 'Kolkata', 'Hyderabad', 'Jaipur', 'Lucknow']
+FIRST_NAMES = ['Aarav', 'Priya', 'Vikram', 'Ananya', 'Rohan', 'Sneha', 'Karan', 'Isha', 'Arjun', 'Meera', 'Ravi', 'Neha']
+LAST_NAMES = ['Sharma', 'Patel', 'Singh', 'Gupta', 'Kumar', 'Mehta', 'Kulkarni', 'Iyer', 'Reddy', 'Das']
+DEPARTMENTS = ['Software Development', 'Human Resources', 'Marketing', 'Finance', 'Sales', 'Research and Development']
+LANGUAGES = ['Python', 'Java', 'C', 'C++', 'Go', 'Rust', 'JavaScript', None]
+PUBLISHERS = ["O'Reilly Media", 'Prentice Hall', 'No Starch Press', 'Manning', 'Addison-Wesley', 'Packt']
+TITLE_WORDS = ['Clean', 'Code', 'Design', 'Patterns', 'Data', 'Systems', 'Programming', 'Practical', 'Effective',
+               'Modern', 'Learning', 'Crash', 'Course', 'Algorithms', 'Concurrency', 'Networks', 'Testing']
+
+
+def patient_id(i):
+    return f"P{i:03d}"
+
+
+def book_isbn(i):
+    return f"978-{i:010d}-{i % 10}"
+
+
+def employee_id(i):
+    return f"E{i:03d}"
+
+
+def _name(rng):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def _verdict(bmi):
+    if bmi < 18.5:
+        return 'Underweight'
+    elif bmi < 25:
+        return 'Normal'
+    elif bmi < 30:
+        return 'Overweight'
+    return 'Obese'
+
+
+def patients(n, seed=0):
+    rng = random.Random(seed)
+    data = {}
+    for i in range(1, n + 1):
+        height = round(rng.uniform(1.45, 1.95), 2)
+        weight = round(rng.uniform(40, 120), 1)
+        bmi = round(weight / height ** 2, 2)
+        data[patient_id(i)] = {
+            'name': _name(rng),
+            'city': rng.choice(CITIES),
+            'age': rng.randint(18, 90),
+            'gender': rng.choice(['Male', 'Female']),
+            'height': height,
+            'weight': weight,
+            'bmi': bmi,
+            'verdict': _verdict(bmi),
+        }
+    return data
+
+
+def books(n, seed=0):
+    rng = random.Random(seed)
+    return [
+        {
+            'id': i,
+            'isbn': book_isbn(i),
+            'title': ' '.join(rng.sample(TITLE_WORDS, 3)),
+            'author': _name(rng),
+            'programming_language': rng.choice(LANGUAGES),
+            'publisher': rng.choice(PUBLISHERS),
+            'price': round(rng.uniform(9.99, 99.99), 2),
+            'publication_year': rng.randint(1975, 2025),
+        }
+        for i in range(1, n + 1)
+    ]
+
+
+def employees(n, seed=0):
+    rng = random.Random(seed)
+    start = date(2005, 1, 1)
+    data = {}
+    for i in range(n):
+        name = _name(rng)
+        data[employee_id(i)] = {
+            'name': name,
+            'email': f"{name.lower().replace(' ', '.')}{i}@example.com",
+            'department': rng.choice(DEPARTMENTS),
+            'date_joined': (start + timedelta(days=rng.randint(0, 7300))).isoformat(),
+            'salary': f"{rng.randint(30000, 250000)}.00",
+        }
+    return data
+
+
+GENERATORS = {
+    'patients': ('patients.json', patients),
+    'books': ('books.json', books),
+    'employees': ('employees.json', employees),
+}
+
+
+def ensure(kind, n, data_dir):
+    """Path of the ``kind`` dataset with ``n`` records, generating it if missing."""
+    filename, generate = GENERATORS[kind]
+    path = os.path.join(data_dir, f"{kind}-{n}", filename)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(generate(n), f)
+    return path
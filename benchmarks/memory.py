@@ -0,0 +1,116 @@
+"""Resident memory of the in-memory stores, with dict and compact records.
+
+Each measurement runs in a fresh interpreter: the app module is imported
+in a scratch working directory holding an ``n``-record dataset, and RSS is
+read before and after its store loads. Running once with
+``STORE_COMPACT_RECORDS=0`` and once with the default gives the saving of
+``CompactRecord``. Run with ``python -m benchmarks.memory``.
+"""
+import argparse
+import gc
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import datasets
+from benchmarks.run import APPS, load_module
+
+
+# Module attribute holding the resident store of each app.
+STORES = {
+    '07_patients': 'store',
+    'employee_mgmt': 'store',
+    '04_books': 'catalog',
+}
+
+MODES = {
+    'dict': {'STORE_COMPACT_RECORDS': '0'},
+    'compact': {'STORE_COMPACT_RECORDS': '1'},
+}
+
+
+def rss_bytes():
+    """Current resident set size of this process."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # peak rather than current, but the load is the peak here
+        scale = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def measure(name, n, data_dir):
+    """Load ``name``'s store in this process and report RSS around the load."""
+    spec = APPS[name]
+    dataset = datasets.ensure(spec.dataset, n, data_dir)
+    workdir = tempfile.mkdtemp(prefix=f"bench-memory-{name}-")
+    shutil.copy(dataset, workdir)
+    os.chdir(workdir)
+    try:
+        store = getattr(load_module(spec, name), STORES[name])
+        gc.collect()
+        before = rss_bytes()
+        t0 = time.perf_counter()
+        store.load()
+        load_ms = round((time.perf_counter() - t0) * 1000, 3)
+        gc.collect()
+        after = rss_bytes()
+        store.close()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {'rss_before_mb': round(before / 2**20, 1), 'rss_after_mb': round(after / 2**20, 1),
+            'store_mb': round((after - before) / 2**20, 1),
+            'bytes_per_record': round((after - before) / n), 'load_ms': load_ms}
+
+
+def run_child(name, n, mode, data_dir):
+    env = {**os.environ, **MODES[mode]}
+    command = [sys.executable, '-m', 'benchmarks.memory', '--child', name, '--sizes', str(n), '--data-dir', data_dir]
+    output = subprocess.run(command, env=env, check=True, capture_output=True, text=True,
+                            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--apps', nargs='+', default=list(STORES), choices=list(STORES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1_000_000])
+    parser.add_argument('--modes', nargs='+', default=list(MODES), choices=list(MODES))
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'fastapi-series-bench'),
+                        help="where generated datasets are cached between runs")
+    parser.add_argument('--output', default='bench_memory.json')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.child:
+        print(json.dumps(measure(args.child, args.sizes[0], args.data_dir)))
+        return
+    results = []
+    for n in args.sizes:
+        for name in args.apps:
+            by_mode = {}
+            for mode in args.modes:
+                stats = run_child(name, n, mode, args.data_dir)
+                by_mode[mode] = stats
+                results.append({'app': name, 'size': n, 'mode': mode, **stats})
+                print(f"{name:14} {mode:8} n={n:<8} store={stats['store_mb']:>8} MB  "
+                      f"{stats['bytes_per_record']:>5} B/record  load={stats['load_ms']}ms", flush=True)
+            if 'dict' in by_mode and 'compact' in by_mode and by_mode['compact']['store_mb'] > 0:
+                print(f"{name:14} {'ratio':8} n={n:<8} {by_mode['dict']['store_mb'] / by_mode['compact']['store_mb']:.2f}x",
+                      flush=True)
+    with open(args.output, 'w') as f:
+        json.dump({'results': results}, f, indent=2)
+    print(f"wrote {len(results)} results to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
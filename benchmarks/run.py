@@ -0,0 +1,302 @@
+"""Drive the example apps in-process and record latency per endpoint.
+
+Each app is imported from its file with a synthetic dataset of the requested
+size in a scratch working directory, its lifespan is started, and each
+endpoint is called sequentially until ``--requests`` calls or
+``--max-seconds`` have passed. Results are written as JSON so that two runs
+can be diffed with ``python -m benchmarks.compare``.
+"""
+import argparse
+import asyncio
+import gc
+import importlib.util
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+
+from benchmarks import datasets
+from benchmarks.asgi import lifespan, request
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SIZES = [1_000, 100_000, 1_000_000]
+
+
+@dataclass
+class Endpoint:
+    """One benchmarked call; ``make(i, rng, n)`` returns ``(path, params, body)``."""
+    name: str
+    method: str
+    make: object
+    headers: tuple = ()
+
+
+@dataclass
+class AppSpec:
+    path: str
+    dataset: str
+    endpoints: list
+    env: dict = field(default_factory=dict)
+
+
+def _get(path, **params):
+    return lambda i, rng, n: (path, params, None)
+
+
+def _new_patient(i, rng, n):
+    return '/create', None, {
+        'id': f"B{i:07d}", 'name': 'Bench Patient', 'city': 'Pune', 'age': 30,
+        'gender': 'Female', 'height': 1.65, 'weight': 60.0,
+    }
+
+
+def _some_employee(rng, n):
+    return datasets.employee_id(rng.randrange(n))
+
+
+def _new_employee(i, rng, n):
+    return '/employees', None, {
+        'id': datasets.employee_id(n + 1 + i), 'name': 'Bench Employee', 'email': 'bench.employee@example.com',
+        'department': 'Engineering', 'date_joined': '2024-01-15', 'salary': '50000.00',
+    }
+
+
+def _new_book(i, rng, n):
+    return '/books/', None, {
+        'isbn': datasets.book_isbn(n + 1 + i), 'title': 'Benchmarking Python', 'author': 'Bench Author',
+        'programming_language': 'Python', 'publisher': 'Manning', 'price': 42.0, 'publication_year': 2024,
+    }
+
+
+def _some_patient(i, rng, n):
+    return f"/patient/{datasets.patient_id(rng.randint(1, n))}/", None, None
+
+
+PATIENT_READS = [
+    Endpoint('GET /view', 'GET', _get('/view')),
+    Endpoint('GET /patient/{id}/', 'GET', _some_patient),
+]
+
+BOOK_ENDPOINTS = [
+    Endpoint('GET /books/', 'GET', _get('/books/', sort_field='price', sort_order='asc')),
+    Endpoint('GET /books/ filtered', 'GET', _get(
+        '/books/', sort_field='publication_year', sort_order='desc',
+        programming_languages=['Python', 'Go'], min_price=20, max_price=60)),
+    Endpoint('GET /books/ search', 'GET', _get('/books/', sort_field='price', sort_order='asc', search='concurrency')),
+    Endpoint('GET /books/ deep page', 'GET', lambda i, rng, n: (
+        '/books/', {'sort_field': 'price', 'sort_order': 'desc', 'skip': n // 2}, None)),
+    Endpoint('GET /book/id/{id}', 'GET', lambda i, rng, n: (f"/book/id/{rng.randint(1, n)}", None, None)),
+    Endpoint('GET /books/isbn/{isbn}', 'GET',
+             lambda i, rng, n: (f"/books/isbn/{datasets.book_isbn(rng.randint(1, n))}", None, None)),
+    Endpoint('POST /books/', 'POST', _new_book),
+]
+
+APPS = {
+    '03_patients': AppSpec('03__http_methods/main.py', 'patients', [
+        Endpoint('GET /view', 'GET', _get('/view')),
+    ]),
+    '04_patients': AppSpec('04__path_query_params/main.py', 'patients', list(PATIENT_READS)),
+    '04_books': AppSpec('04__path_query_params/books.py', 'books', list(BOOK_ENDPOINTS)),
+    '06_patients': AppSpec('06__post_requests/main.py', 'patients', PATIENT_READS + [
+        Endpoint('POST /create', 'POST', _new_patient),
+    ]),
+    '07_patients': AppSpec('07__put_delete_requests/main.py', 'patients', PATIENT_READS + [
+        # "*" matches any current version, so this measures the 304 path
+        Endpoint('GET /view unchanged', 'GET', _get('/view'), headers=(('If-None-Match', '*'),)),
+        Endpoint('GET /sort', 'GET', _get('/sort', sort_by='bmi', order='desc')),
+        Endpoint('GET /sort page', 'GET', _get('/sort', sort_by='bmi', order='desc', limit=20)),
+        Endpoint('POST /create', 'POST', _new_patient),
+        Endpoint('PUT /edit/{id}', 'PUT', lambda i, rng, n: (
+            f"/edit/{datasets.patient_id(rng.randint(1, n))}", None, {'weight': 55.0 + i % 10})),
+    ]),
+    'employee_mgmt': AppSpec('99__PROJECTS/01__employee_mgmt/main.py', 'employees', [
+        Endpoint('GET /employees', 'GET', _get('/employees')),
+        Endpoint('GET /employees ndjson', 'GET', _get('/employees', stream='ndjson')),
+        Endpoint('GET /employees unchanged', 'GET', _get('/employees'), headers=(('If-None-Match', '*'),)),
+        Endpoint('GET /employees/{id}', 'GET', lambda i, rng, n: (f"/employees/{_some_employee(rng, n)}", None, None)),
+        Endpoint('PUT /employees/{id}', 'PUT',
+                 lambda i, rng, n: (f"/employees/{_some_employee(rng, n)}", None, {'salary': f"{50000 + i}.00"})),
+        Endpoint('POST /employees', 'POST', _new_employee),
+    ]),
+}
+
+APPS['employee_mgmt_sharded'] = AppSpec('99__PROJECTS/01__employee_mgmt/main.py', 'employees',
+                                       APPS['employee_mgmt'].endpoints, env={'EMPLOYEE_SHARDS': '8'})
+
+APPS['07_patients_mmap'] = AppSpec('07__put_delete_requests/main.py', 'patients', APPS['07_patients'].endpoints,
+                                  env={'PATIENT_STORE': 'mmap'})
+APPS['07_patients_shared'] = AppSpec('07__put_delete_requests/main.py', 'patients', APPS['07_patients'].endpoints,
+                                    env={'PATIENT_STORE': 'shared'})
+
+if importlib.util.find_spec('numpy') is not None:
+    APPS['04_books_columnar'] = AppSpec('04__path_query_params/books.py', 'books', list(BOOK_ENDPOINTS),
+                                        env={'BOOKS_BACKEND': 'columnar'})
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, round(q / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def load_module(spec, name):
+    """Import the app module from its file under a unique module name."""
+    path = os.path.join(ROOT, spec.path)
+    app_dir = os.path.dirname(path)
+    sys.path.insert(0, app_dir)
+    try:
+        module_spec = importlib.util.spec_from_file_location(f"bench_{name}", path)
+        module = importlib.util.module_from_spec(module_spec)
+        module_spec.loader.exec_module(module)
+    finally:
+        sys.path.remove(app_dir)
+    return module
+
+
+def summarize(latencies, elapsed, errors=0, response_bytes=0):
+    """Throughput and latency percentiles for one benchmarked operation."""
+    latencies = sorted(latencies)
+    ms = lambda seconds: None if seconds is None else round(seconds * 1000, 3)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'mean_ms': ms(sum(latencies) / len(latencies)),
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'mean_response_bytes': response_bytes // len(latencies),
+    }
+
+
+async def bench_endpoint(app, endpoint, n, max_requests, max_seconds, seed, warmup=0):
+    rng = random.Random(seed)
+    for i in range(warmup):
+        path, params, body = endpoint.make(max_requests + i, rng, n)
+        try:
+            await request(app, endpoint.method, path, params, body, endpoint.headers)
+        except Exception:
+            pass
+    latencies = []
+    errors = 0
+    response_bytes = 0
+    started = time.perf_counter()
+    for i in itertools.count():
+        if i >= max_requests or (i and time.perf_counter() - started >= max_seconds):
+            break
+        path, params, body = endpoint.make(i, rng, n)
+        t0 = time.perf_counter()
+        try:
+            response = await request(app, endpoint.method, path, params, body, endpoint.headers)
+        except Exception:
+            # Unhandled app errors are re-raised after the 500 is sent.
+            latencies.append(time.perf_counter() - t0)
+            errors += 1
+            continue
+        latencies.append(time.perf_counter() - t0)
+        response_bytes += len(response.body)
+        if response.status >= 400:
+            errors += 1
+    return summarize(latencies, time.perf_counter() - started, errors, response_bytes)
+
+
+@asynccontextmanager
+async def running_app(name, spec, n, data_dir):
+    """Start ``spec``'s app on a scratch copy of an ``n``-record dataset.
+
+    Yields the app and its startup time in ms; the working directory and
+    environment are restored afterwards.
+    """
+    dataset = datasets.ensure(spec.dataset, n, data_dir)
+    workdir = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    shutil.copy(dataset, workdir)
+    cwd = os.getcwd()
+    saved_env = {key: os.environ.get(key) for key in spec.env}
+    os.environ.update(spec.env)
+    os.chdir(workdir)
+    try:
+        app = load_module(spec, name).app
+        t0 = time.perf_counter()
+        async with lifespan(app):
+            yield app, round((time.perf_counter() - t0) * 1000, 3)
+    finally:
+        os.chdir(cwd)
+        for key, value in saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        shutil.rmtree(workdir, ignore_errors=True)
+        gc.collect()
+
+
+async def bench_app(name, spec, n, args):
+    results = []
+    async with running_app(name, spec, n, args.data_dir) as (app, startup_ms):
+        for endpoint in spec.endpoints:
+            if args.endpoint and not any(pattern in endpoint.name for pattern in args.endpoint):
+                continue
+            stats = await bench_endpoint(app, endpoint, n, args.requests, args.max_seconds, args.seed, args.warmup)
+            result = {'app': name, 'endpoint': endpoint.name, 'size': n, 'startup_ms': startup_ms, **stats}
+            results.append(result)
+            print(f"{name:14} {endpoint.name:28} n={n:<8} {stats['throughput_rps']:>10} req/s  "
+                  f"p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms errors={stats['errors']}", flush=True)
+    return results
+
+
+async def main_async(args):
+    results = []
+    for n in args.sizes:
+        for name in args.apps:
+            results.extend(await bench_app(name, APPS[name], n, args))
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--apps', nargs='+', default=list(APPS), choices=list(APPS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES)
+    parser.add_argument('--endpoint', nargs='+', help="only endpoints whose name contains one of these")
+    parser.add_argument('--requests', type=int, default=200, help="maximum requests per endpoint")
+    parser.add_argument('--max-seconds', type=float, default=5.0, help="time budget per endpoint")
+    parser.add_argument('--warmup', type=int, default=3, help="unrecorded requests before each endpoint")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'fastapi-series-bench'),
+                        help="where generated datasets are cached between runs")
+    parser.add_argument('--output', default='bench_results.json')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = asyncio.run(main_async(args))
+    report = {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'sizes': args.sizes,
+            'requests': args.requests,
+            'max_seconds': args.max_seconds,
+            'warmup': args.warmup,
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {len(results)} results to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
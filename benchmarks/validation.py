@@ -0,0 +1,80 @@
+"""Compare the two ways of validating and serialising the employee list.
+
+``loop`` is the original list endpoint, its body unchanged: one
+``Employee(**emp, id=emp_id)`` per record of the loaded dict, returned to
+FastAPI, which encodes it with ``serialize_response`` as it does for a route
+without a response model and wraps it in ``JSONResponse``. ``adapter`` is
+the current endpoint's ``build_employee_list``: a single ``validate_python``
+and ``dump_json`` on the cached ``TypeAdapter(List[Employee])``. Both start
+from the same dict of records. Output uses the
+same format as ``benchmarks.run`` so it can be fed to
+``benchmarks.compare``.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+
+from benchmarks import datasets
+from benchmarks.run import APPS, load_module, summarize
+
+
+async def original_list_employees(module, data):
+    employees = [module.Employee(**emp, id=emp_id) for emp_id, emp in data.items()]
+    return employees
+
+
+def loop_path(module, data, loop):
+    async def respond():
+        content = await serialize_response(response_content=await original_list_employees(module, data))
+        return JSONResponse(content)
+    return loop.run_until_complete(respond()).body
+
+
+def adapter_path(module, data, loop):
+    adapter = module.employee_list_adapter
+    employees = adapter.validate_python([{**emp, "id": emp_id} for emp_id, emp in data.items()])
+    return adapter.dump_json(employees)
+
+
+PATHS = {'loop': loop_path, 'adapter': adapter_path}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', type=int, default=[1_000, 100_000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--max-seconds', type=float, default=10.0, help="time budget per path and size")
+    parser.add_argument('--output', default='bench_results_validation.json')
+    args = parser.parse_args(argv)
+
+    module = load_module(APPS['employee_mgmt'], 'employee_mgmt_validation')
+    loop = asyncio.new_event_loop()
+    results = []
+    for n in args.sizes:
+        data = datasets.employees(n)
+        for name, path in PATHS.items():
+            latencies = []
+            response_bytes = 0
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                body = path(module, data, loop)
+                latencies.append(time.perf_counter() - t0)
+                response_bytes += len(body)
+                if time.perf_counter() - started >= args.max_seconds:
+                    break
+            stats = summarize(latencies, time.perf_counter() - started, 0, response_bytes)
+            results.append({'app': 'employee_mgmt', 'endpoint': f"list validation {name}", 'size': n, **stats})
+            print(f"{name:8} n={n:<8} p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms", flush=True)
+    loop.close()
+    with open(args.output, 'w') as f:
+        json.dump({'meta': {'sizes': args.sizes, 'repeat': args.repeat}, 'results': results}, f, indent=2)
+    print(f"wrote {len(results)} results to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
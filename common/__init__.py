@@ -0,0 +1 @@
+"""Helpers shared by the example FastAPI apps in this repository."""
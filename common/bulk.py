@@ -0,0 +1,75 @@
+"""Shared handling for bulk create/update/delete endpoints."""
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import ValidationError
+
+from common.metrics import timed
+from common.store import ConflictError
+
+
+def item_result(key, status, detail=None):
+    result = {'id': key, 'status': status}
+    if detail is not None:
+        result['detail'] = jsonable_encoder(detail)
+    return result
+
+
+def validate_items(model, items, results):
+    """Yield ``(item, model instance)`` for the raw ``items`` that validate.
+
+    Bulk endpoints take their items untyped and validate them here one by
+    one, so an invalid item gets its own 422 in ``results`` instead of
+    FastAPI rejecting the whole body, and ``atomic=false`` still applies
+    the rest.
+    """
+    for item in items:
+        try:
+            with timed('validation'):
+                instance = model.model_validate(item)
+        except ValidationError as e:
+            key = item.get('id') if isinstance(item, dict) else None
+            results.append(item_result(key, 422, e.errors(include_url=False)))
+            continue
+        yield item, instance
+
+
+async def apply_batch(store, changes, results, atomic, success_status=200, expected=None):
+    """Persist the valid ``changes`` of a batch with one write and report per item.
+
+    ``results`` holds one ``item_result`` per submitted item. If every item
+    succeeded the response uses ``success_status``. Otherwise an atomic batch
+    applies nothing and answers 409, marking the items that were fine as 424,
+    while a non-atomic batch applies the valid items and answers 207.
+
+    ``expected`` maps keys to the revisions their records were read at, or
+    to ``ABSENT`` for creates. An item whose record another request changed
+    since is marked 409, and a create whose key another request took is
+    marked 400; either counts as failed, so no change is written over
+    another.
+    """
+    changes = list(changes)
+    expected = {key: expected[key] for key, _ in changes if key in expected} if expected else None
+    while True:
+        failed = sum(result['status'] >= 400 for result in results)
+        if failed and atomic:
+            for result in results:
+                if result['status'] < 400:
+                    result['status'] = 424
+                    result['detail'] = "Not applied: another item in the batch failed"
+            status_code, applied = 409, 0
+            break
+        try:
+            await store.aapply(changes, expected)
+        except ConflictError as e:
+            # nothing was applied; retry without the item, or fail the batch
+            for result in results:
+                if result['id'] == e.key and result['status'] < 400:
+                    result['status'] = e.status_code
+                    result['detail'] = e.detail
+            changes = [change for change in changes if change[0] != e.key]
+            expected.pop(e.key, None)
+            continue
+        status_code = 207 if failed else success_status
+        applied = len(results) - failed
+        break
+    return JSONResponse(status_code=status_code, content={'applied': applied, 'failed': failed, 'results': results})
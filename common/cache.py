@@ -0,0 +1,92 @@
+"""Bounded in-process result cache with per-entry expiry."""
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Least-recently-used cache whose entries also expire after ``ttl`` seconds.
+
+    At most ``maxsize`` entries are kept; storing one more evicts the least
+    recently read. A ``maxsize`` of 0 disables caching. Counters for hits,
+    misses, evictions, expiries and invalidations are kept for ``/metrics``.
+    """
+
+    def __init__(self, name, maxsize=1024, ttl=30.0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, predicate=None):
+        """Drop every entry, or only those whose key satisfies ``predicate``."""
+        with self._lock:
+            if predicate is None:
+                dropped = list(self._entries)
+            else:
+                dropped = [key for key in self._entries if predicate(key)]
+            for key in dropped:
+                del self._entries[key]
+            self.invalidations += len(dropped)
+        return len(dropped)
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.maxsize,
+            'ttl_seconds': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
+
+    def render_metrics(self):
+        """Prometheus lines for this cache, labelled with its name."""
+        label = f'cache="{self.name}"'
+        lines = []
+        for metric, kind, value in (
+            ('cache_hits_total', 'counter', self.hits),
+            ('cache_misses_total', 'counter', self.misses),
+            ('cache_evictions_total', 'counter', self.evictions),
+            ('cache_expirations_total', 'counter', self.expirations),
+            ('cache_invalidations_total', 'counter', self.invalidations),
+            ('cache_entries', 'gauge', len(self._entries)),
+            ('cache_max_entries', 'gauge', self.maxsize),
+        ):
+            lines += [f'# TYPE {metric} {kind}', f'{metric}{{{label}}} {value}']
+        return lines
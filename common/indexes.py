@@ -0,0 +1,76 @@
+"""Secondary indexes kept in step with a JsonStore."""
+import bisect
+
+
+class SortedIndex:
+    """Store keys kept sorted by one field of their records.
+
+    Entries are ordered by ``(value, key)``, so ties are ordered by key.
+    They are held as two parallel lists, values and keys, which costs two
+    pointers per record where a list of tuples would add a tuple each. The
+    store calls ``insert``/``remove`` on every change, which keeps the lists
+    sorted with bisect instead of re-sorting the whole dataset per request.
+    """
+
+    def __init__(self, field, default=0):
+        self.field = field
+        self.default = default
+        self._values = []
+        self._keys = []
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _entry(self, key, record):
+        return (record.get(self.field, self.default), key)
+
+    def _position(self, value, key, right=False):
+        # the run of equal values first, then the key within it
+        lo = bisect.bisect_left(self._values, value)
+        hi = bisect.bisect_right(self._values, value, lo)
+        return (bisect.bisect_right if right else bisect.bisect_left)(self._keys, key, lo, hi)
+
+    def rebuild(self, data):
+        entries = sorted(self._entry(key, record) for key, record in data.items())
+        self._values = [value for value, _ in entries]
+        self._keys = [key for _, key in entries]
+
+    def rebuilt(self, data):
+        """A new index on the same field over ``data``; this one is left as it is."""
+        index = type(self)(self.field, self.default)
+        index.rebuild(data)
+        return index
+
+    def insert(self, key, record):
+        value, key = self._entry(key, record)
+        i = self._position(value, key)
+        self._values.insert(i, value)
+        self._keys.insert(i, key)
+
+    def remove(self, key, record):
+        value, key = self._entry(key, record)
+        i = self._position(value, key)
+        if i < len(self._keys) and self._keys[i] == key and self._values[i] == value:
+            del self._values[i]
+            del self._keys[i]
+
+    def keys(self, reverse=False, offset=0, limit=None, after=None):
+        """Keys in ascending (or descending) order, optionally one page only.
+
+        ``after`` is an exclusive ``(value, key)`` bound in walk order, so a
+        page can start where the previous one ended without counting the
+        entries before it.
+        """
+        lo, hi = 0, len(self._keys)
+        if after is not None:
+            if reverse:
+                hi = self._position(*after)
+            else:
+                lo = self._position(*after, right=True)
+        n = hi - lo
+        stop = n if limit is None else min(n, offset + limit)
+        if offset >= stop:
+            return []
+        if reverse:
+            return self._keys[hi - stop:hi - offset][::-1]
+        return self._keys[lo + offset:lo + stop]
@@ -0,0 +1,176 @@
+"""Per-route request metrics exposed in Prometheus text format.
+
+``install_metrics(app)`` adds a pure ASGI middleware and a ``/metrics``
+route. For every request it records the count by status, a latency
+histogram, a response size histogram and the number of requests in flight.
+Code inside a request can wrap work in ``timed('storage')``,
+``timed('validation')`` or ``timed('serialization')`` to split handler time
+into stages. Recording is a few dict lookups and a bisect per request.
+Other components (caches, stores) can append their own lines with
+``metrics.add_collector``.
+"""
+import bisect
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from fastapi.responses import PlainTextResponse
+
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+# Stage durations of the current request, or None outside a request.
+_stages = ContextVar('request_stages', default=None)
+
+
+@contextmanager
+def timed(stage):
+    """Add the time spent in the block to ``stage`` of the current request."""
+    stages = _stages.get()
+    if stages is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages[stage] = stages.get(stage, 0.0) + time.perf_counter() - t0
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        self.requests = {}
+        self.latency = {}
+        self.sizes = {}
+        self.stages = {}
+        self.in_flight = 0
+        self.collectors = []
+
+    def add_collector(self, collector):
+        """Append the Prometheus lines returned by ``collector()`` to every render."""
+        self.collectors.append(collector)
+
+    def record(self, method, route, status, duration, size, stages):
+        key = (method, route)
+        counter = (method, route, status)
+        self.requests[counter] = self.requests.get(counter, 0) + 1
+        if key not in self.latency:
+            self.latency[key] = Histogram(LATENCY_BUCKETS)
+            self.sizes[key] = Histogram(SIZE_BUCKETS)
+        self.latency[key].observe(duration)
+        self.sizes[key].observe(size)
+        for stage, seconds in stages.items():
+            stage_key = (method, route, stage)
+            if stage_key not in self.stages:
+                self.stages[stage_key] = Histogram(LATENCY_BUCKETS)
+            self.stages[stage_key].observe(seconds)
+
+    def render(self):
+        lines = [
+            '# HELP http_requests_total Requests handled, by route and status.',
+            '# TYPE http_requests_total counter',
+        ]
+        for (method, route, status), count in sorted(self.requests.items()):
+            lines.append(f'http_requests_total{{method="{method}",route="{route}",status="{status}"}} {count}')
+        lines += [
+            '# HELP http_requests_in_flight Requests currently being handled.',
+            '# TYPE http_requests_in_flight gauge',
+            f'http_requests_in_flight {self.in_flight}',
+            '# HELP http_request_duration_seconds Time from request start to the last response byte.',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        for (method, route), histogram in sorted(self.latency.items()):
+            lines += histogram.render('http_request_duration_seconds', f'method="{method}",route="{route}"')
+        lines += [
+            '# HELP http_response_size_bytes Response body size.',
+            '# TYPE http_response_size_bytes histogram',
+        ]
+        for (method, route), histogram in sorted(self.sizes.items()):
+            lines += histogram.render('http_response_size_bytes', f'method="{method}",route="{route}"')
+        lines += [
+            '# HELP http_request_stage_duration_seconds Handler time split into storage, validation and serialization.',
+            '# TYPE http_request_stage_duration_seconds histogram',
+        ]
+        for (method, route, stage), histogram in sorted(self.stages.items()):
+            lines += histogram.render('http_request_stage_duration_seconds',
+                                      f'method="{method}",route="{route}",stage="{stage}"')
+        for collector in self.collectors:
+            lines += collector()
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsMiddleware:
+    def __init__(self, app, metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        metrics = self.metrics
+        status = 500
+        size = 0
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            elif message['type'] == 'http.response.body':
+                size += len(message.get('body', b''))
+            await send(message)
+
+        stages = {}
+        token = _stages.set(stages)
+        metrics.in_flight += 1
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - t0
+            metrics.in_flight -= 1
+            _stages.reset(token)
+            # The router stores the matched route in the scope; fall back to a
+            # fixed label so unknown paths cannot blow up label cardinality.
+            route = scope.get('route')
+            route = getattr(route, 'path', None) or 'unmatched'
+            metrics.record(scope['method'], route, status, duration, size, stages)
+
+
+def install_metrics(app, path='/metrics'):
+    """Record request metrics for ``app`` and serve them at ``path``."""
+    metrics = Metrics()
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
+
+    @app.get(path, include_in_schema=False)
+    async def prometheus_metrics():
+        return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+    return metrics
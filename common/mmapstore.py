@@ -0,0 +1,351 @@
+"""Fixed-width binary records in a memory-mapped file, same interface as ``JsonStore``."""
+import json
+import mmap
+import os
+import struct
+import threading
+
+from fastapi import HTTPException
+
+from common.metrics import timed
+from common.store import KeyLocks, RecordRevisions, VersionStamp, resolved, run_io
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Field kind for strings kept as a u32 code into the store's string table.
+INTERNED = 'interned'
+
+MAGIC = b'FWREC\x00\x00\x01'
+# magic, record struct format, number of slots in use
+HEADER = struct.Struct('<8s64sQ')
+HEADER_SIZE = 128
+# interned None
+NO_STRING = 0xFFFFFFFF
+
+LIVE, DELETED = 1, 0
+
+
+class MmapStore(RecordRevisions):
+    """Records of one fixed layout, ``struct``-packed into slots of a mapped file.
+
+    ``fields`` lists ``(name, kind)`` pairs, where ``kind`` is a ``struct``
+    code (``'d'``, ``'h'``, ``'64s'`` for a UTF-8 string of at most 64
+    bytes) or ``INTERNED`` for strings with few distinct values, such as a
+    city, which are stored as a code into a table kept in
+    ``path + '.strings'``. Each slot is a live/deleted flag, the key (at
+    most ``key_size`` bytes) and the fields in order.
+
+    Only the key -> slot map lives in memory; it is rebuilt at startup by
+    scanning the keys, without decoding the records. ``get`` unpacks one
+    slot, and an update overwrites its slot in place and msyncs the pages it
+    touched, so neither depends on the number of records. Deleted slots are
+    reused and the file doubles when it is full.
+
+    There is one writer: the slot map, the free list, the used count and the
+    string table are only in this process's memory, so a second process
+    writing the file would hand out the same slots and string codes. ``load``
+    takes an exclusive lock on the file, held until ``close``, and refuses
+    to start if another process has it; serve with one worker, or use a
+    ``SharedJsonStore`` or ``SqliteStore`` for several.
+
+    A multi-record ``apply`` is checked and encoded before anything is
+    written, but a crash part way through writing can leave some of its
+    records updated. On first load a missing file is seeded from
+    ``seed_path`` as ``SqliteStore`` does. Secondary indexes behave as they
+    do for ``JsonStore``.
+    """
+
+    def __init__(self, path, fields, key_size=16, indexes=(), seed_path=None):
+        self.path = path
+        self.strings_path = f"{path}.strings"
+        self.fields = list(fields)
+        self.key_size = key_size
+        self.indexes = list(indexes)
+        self.seed_path = seed_path
+        codes = ''.join('I' if kind == INTERNED else kind for _, kind in self.fields)
+        self.format = f"<B{key_size}s{codes}"
+        self._record = struct.Struct(self.format)
+        self._key = struct.Struct(f"<B{key_size}s{self._record.size - 1 - key_size}x")
+        self.stamp = VersionStamp()
+        self._lock = threading.Lock()
+        self._key_locks = KeyLocks()
+        self._file = None
+        self._mm = None
+        self._slots = {}
+        self._free = []
+        self._used = 0
+        self._strings = []
+        self._string_codes = {}
+        self._strings_file = None
+        self._reset_revisions()
+
+    def _offset(self, slot):
+        return HEADER_SIZE + slot * self._record.size
+
+    @property
+    def _capacity(self):
+        return (len(self._mm) - HEADER_SIZE) // self._record.size
+
+    def load(self):
+        with self._lock, timed('storage'):
+            if self._file is None:
+                self._file = os.fdopen(os.open(self.path, os.O_RDWR | os.O_CREAT), 'r+b')
+                self._lock_file()
+            # created here, or left empty by a process that stopped before writing the header
+            seed = os.fstat(self._file.fileno()).st_size == 0
+            if seed:
+                self._file.write(HEADER.pack(MAGIC, self.format.encode(), 0).ljust(HEADER_SIZE, b'\0'))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            self._mm = mmap.mmap(self._file.fileno(), 0)
+            magic, layout, self._used = HEADER.unpack_from(self._mm)
+            if magic != MAGIC or layout.rstrip(b'\0').decode() != self.format:
+                raise HTTPException(status_code=500, detail=f"{self.path} was written with a different record layout")
+            self._load_strings()
+            self._slots, self._free = {}, []
+            used = self._mm[HEADER_SIZE:self._offset(self._used)]
+            for slot, (flag, key) in enumerate(self._key.iter_unpack(used)):
+                if flag == LIVE:
+                    self._slots[key.rstrip(b'\0').decode()] = slot
+                else:
+                    self._free.append(slot)
+            if seed and self.seed_path and os.path.exists(self.seed_path):
+                # the indexes are built from scratch below
+                self._write([(key, self._encode(key, record)) for key, record in self._read_seed()])
+        if self.indexes:
+            data = self._columns({index.field for index in self.indexes})
+            for index in self.indexes:
+                index.rebuild(data)
+        self.stamp.loaded(self.path)
+        self._reset_revisions()
+        return self
+
+    def _lock_file(self):
+        fd = self._file.fileno()
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        except OSError:
+            self._file.close()
+            self._file = None
+            raise RuntimeError(
+                f"{self.path} is in use by another process; MmapStore allows a single writer, "
+                "so run one worker or use a store that supports several"
+            )
+
+    def _load_strings(self):
+        self._strings, self._string_codes = [], {}
+        if os.path.exists(self.strings_path):
+            with open(self.strings_path, 'r') as f:
+                for line in f:
+                    value = json.loads(line)
+                    self._string_codes[value] = len(self._strings)
+                    self._strings.append(value)
+        if self._strings_file is None:
+            self._strings_file = open(self.strings_path, 'a')
+
+    def _read_seed(self):
+        try:
+            with open(self.seed_path, 'r') as f:
+                return list(json.load(f).items())
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=500, detail=f"Invalid JSON in {self.seed_path}")
+
+    def _intern(self, value):
+        if value is None:
+            return NO_STRING
+        code = self._string_codes.get(value)
+        if code is None:
+            # on disk before any record that refers to it
+            self._strings_file.write(json.dumps(value) + '\n')
+            self._strings_file.flush()
+            os.fsync(self._strings_file.fileno())
+            code = self._string_codes[value] = len(self._strings)
+            self._strings.append(value)
+        return code
+
+    def _encode(self, key, record):
+        encoded_key = key.encode()
+        if len(encoded_key) > self.key_size:
+            raise HTTPException(status_code=422, detail=f"Key {key!r} is longer than {self.key_size} bytes")
+        values = []
+        for name, kind in self.fields:
+            value = record.get(name)
+            if kind == INTERNED:
+                value = self._intern(value)
+            elif kind.endswith('s'):
+                value = (value or '').encode()
+                if len(value) > int(kind[:-1]):
+                    raise HTTPException(status_code=422, detail=f"{name} is longer than {kind[:-1]} bytes")
+            elif value is None:
+                value = 0
+            values.append(value)
+        try:
+            return self._record.pack(LIVE, encoded_key, *values)
+        except struct.error as e:
+            raise HTTPException(status_code=422, detail=f"Record {key!r} does not fit the layout: {e}")
+
+    def _decode(self, values):
+        record = {}
+        for (name, kind), value in zip(self.fields, values[2:]):
+            if kind == INTERNED:
+                value = None if value == NO_STRING else self._strings[value]
+            elif kind.endswith('s'):
+                value = value.rstrip(b'\0').decode()
+            record[name] = value
+        return record
+
+    def __contains__(self, key):
+        return key in self._slots
+
+    def __len__(self):
+        return len(self._slots)
+
+    def get(self, key, default=None):
+        slot = self._slots.get(key)
+        if slot is None:
+            return default
+        # the map is read after the slot, so it is at least as large
+        values = self._record.unpack_from(self._mm, self._offset(slot))
+        # the slot may have been freed and reused since it was looked up
+        if values[0] != LIVE or values[1].rstrip(b'\0').decode() != key:
+            moved = self._slots.get(key)
+            return default if moved in (None, slot) else self.get(key, default)
+        return self._decode(values)
+
+    def items(self):
+        with timed('storage'):
+            # one copy of the used slots, consistent with the writes before it
+            with self._lock:
+                used = self._mm[HEADER_SIZE:self._offset(self._used)]
+            return [(values[1].rstrip(b'\0').decode(), self._decode(values))
+                    for values in self._record.iter_unpack(used) if values[0] == LIVE]
+
+    def values(self):
+        return [record for _, record in self.items()]
+
+    def _columns(self, names):
+        """``{key: {name: value}}`` of numeric fields only, for building indexes."""
+        positions = [(name, i + 2) for i, (name, _) in enumerate(self.fields) if name in names]
+        with self._lock:
+            used = self._mm[HEADER_SIZE:self._offset(self._used)]
+        return {values[1].rstrip(b'\0').decode(): {name: values[i] for name, i in positions}
+                for values in self._record.iter_unpack(used) if values[0] == LIVE}
+
+    def put(self, key, record):
+        self.apply([(key, record)])
+        return record
+
+    def delete(self, key):
+        record = self.get(key)
+        if record is None:
+            raise KeyError(key)
+        self.apply([(key, None)])
+        return record
+
+    def _read_versioned(self, key):
+        with self._lock:
+            return self.revision(key), self.get(key)
+
+    def _grow(self, slots):
+        """Extend the file to hold at least ``slots`` records and map it again."""
+        capacity = max(slots, 2 * self._capacity, 1024)
+        self._file.truncate(self._offset(capacity))
+        # readers holding the old map keep using it; it shares the same pages
+        self._mm = mmap.mmap(self._file.fileno(), 0)
+
+    def apply(self, changes, expected=None):
+        """Apply ``(key, record)`` changes, ``None`` meaning delete, then msync.
+
+        ``expected`` and the return value work as in ``JsonStore.apply``.
+        """
+        if not changes:
+            return self.stamp.version
+        with self._lock:
+            self._check_expected(expected)
+            encoded = [(key, None if record is None else self._encode(key, record)) for key, record in changes]
+            transitions = [(key, self.get(key), record) for key, record in changes] if self.indexes else []
+            self._write(encoded)
+            version = self._committed(changes)
+            for key, old, new in transitions:
+                for index in self.indexes:
+                    if old is not None:
+                        index.remove(key, old)
+                    if new is not None:
+                        index.insert(key, new)
+        return version
+
+    def _write(self, encoded):
+        """Put packed records (``None`` deletes) into their slots and msync them."""
+        new_keys = {key for key, data in encoded if data is not None and key not in self._slots}
+        touched = []
+        try:
+            with timed('storage'):
+                if self._used + len(new_keys) - len(self._free) > self._capacity:
+                    self._grow(self._used + len(new_keys))
+                for key, data in encoded:
+                    slot = self._slots.get(key)
+                    if data is None:
+                        if slot is not None:
+                            self._mm[self._offset(slot)] = DELETED
+                            del self._slots[key]
+                            self._free.append(slot)
+                            touched.append(slot)
+                        continue
+                    if slot is None:
+                        slot = self._free.pop() if self._free else self._next_slot()
+                    self._mm[self._offset(slot):self._offset(slot + 1)] = data
+                    self._slots[key] = slot
+                    touched.append(slot)
+                HEADER.pack_into(self._mm, 0, MAGIC, self.format.encode(), self._used)
+                self._sync(touched)
+        except OSError as e:
+            raise HTTPException(status_code=500, detail=f"Failed to save data: {str(e)}")
+
+    def _next_slot(self):
+        self._used += 1
+        return self._used - 1
+
+    def _sync(self, slots):
+        """msync the header and the pages holding ``slots``."""
+        pages = {0}
+        for slot in slots:
+            start = self._offset(slot)
+            pages.update(range(start // mmap.PAGESIZE, (start + self._record.size - 1) // mmap.PAGESIZE + 1))
+        pages = sorted(pages)
+        run_start = previous = pages[0]
+        for page in pages[1:] + [None]:
+            if page != previous + 1:
+                end = min((previous + 1) * mmap.PAGESIZE, len(self._mm))
+                self._mm.flush(run_start * mmap.PAGESIZE, end - run_start * mmap.PAGESIZE)
+                run_start = page
+            previous = page
+
+    def _submit(self, changes, expected=None):
+        # the pages are synced once apply returns
+        return self.apply(changes, expected), resolved()
+
+    async def aload(self):
+        return await run_io(self.load)
+
+    async def aput(self, key, record):
+        return await run_io(self.put, key, record)
+
+    async def adelete(self, key):
+        return await run_io(self.delete, key)
+
+    async def aapply(self, changes, expected=None):
+        return await run_io(self.apply, changes, expected)
+
+    def close(self):
+        with self._lock:
+            for resource in (self._mm, self._file, self._strings_file):
+                if resource is not None:
+                    resource.close()
+            self._mm = self._file = self._strings_file = None
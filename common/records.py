@@ -0,0 +1,158 @@
+"""Compact in-memory records for the resident stores."""
+import gc
+import os
+from collections.abc import Mapping
+from contextlib import contextmanager
+
+
+# STORE_COMPACT_RECORDS=0 keeps resident records as plain dicts.
+COMPACT_RECORDS = os.getenv("STORE_COMPACT_RECORDS", "1") != "0"
+
+
+class CompactRecord(Mapping):
+    """A record with a fixed set of fields held in ``__slots__``, not a dict.
+
+    Subclasses list their fields in ``__slots__``, in the order they should
+    be serialised, and the fields with few distinct values (a city, a
+    department, a height rounded to the centimetre) in ``INTERNED``. Each
+    distinct value of those is kept once per class and shared by every
+    record, so a million records hold a handful of city names instead of a
+    million copies. A load starts the pools afresh, so values no record
+    holds any more are not kept for good. Records are built with
+    ``Record(mapping)``; the ``__init__`` doing so, and ``_asdict`` going
+    back, are generated per class, as ``namedtuple`` does, because a loop
+    over the fields would dominate loading or writing a large file.
+
+    A record reads like a read-only dict: ``record["name"]``,
+    ``record.get``, ``dict(record)`` and ``**record`` all work, so indexes,
+    ``Model(**record)`` and response models take it as they are. Like the
+    dicts they replace, stored records are never changed in place.
+    """
+
+    __slots__ = ()
+    INTERNED = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._field_set = frozenset(cls.__slots__)
+        cls._pools = {name: {} for name in cls.INTERNED}
+        lines = ["def __init__(self, data):"]
+        for name in cls.__slots__:
+            if name in cls._pools:
+                # 1 and 1.0 are equal keys, so the shared value must be of the same type
+                lines += [f"    value = data[{name!r}]",
+                          f"    shared = pool_{name}.setdefault(value, value)",
+                          f"    self.{name} = shared if type(shared) is type(value) else value"]
+            else:
+                lines.append(f"    self.{name} = data[{name!r}]")
+        fields = ", ".join(f"{name!r}: self.{name}" for name in cls.__slots__)
+        lines += ["def _asdict(self):", f"    return {{{fields}}}"]
+        namespace = {f"pool_{name}": pool for name, pool in cls._pools.items()}
+        exec("\n".join(lines), namespace)
+        cls.__init__ = namespace["__init__"]
+        cls._asdict = namespace["_asdict"]
+
+    @classmethod
+    def clear_pools(cls):
+        """Forget the shared values; records already built keep theirs."""
+        for pool in cls._pools.values():
+            pool.clear()
+
+    @classmethod
+    def from_dict(cls, data):
+        """``data`` as a record, or unchanged if its keys are not exactly the fields."""
+        if type(data) is not dict or len(data) != len(cls.__slots__):
+            return data
+        try:
+            return cls(data)
+        except (KeyError, TypeError):
+            # a different field, or an unhashable value for an interned one
+            return data
+
+    def __getitem__(self, name):
+        if name not in self._field_set:
+            raise KeyError(name)
+        return getattr(self, name)
+
+    def get(self, name, default=None):
+        return getattr(self, name) if name in self._field_set else default
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self._asdict()!r})"
+
+
+@contextmanager
+def loading(record_type=None):
+    """Build many ``record_type`` records without the cyclic GC scanning them as they come.
+
+    Unlike dicts of plain values, records are tracked by the GC, so loading
+    a million of them would run collections over an ever larger heap.
+    Collection is paused for the block and resumed after it; see
+    ``freeze_heap`` for keeping later full collections off the loaded
+    records. The interning pools of ``record_type`` are cleared first, so
+    they hold only the values of the records loaded and written from now
+    on. Nested blocks, such as the shards of one store, leave all of this
+    to the outermost.
+    """
+    if record_type is None:
+        yield
+        return
+    was_enabled = gc.isenabled()
+    if was_enabled:
+        record_type.clear_pools()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if was_enabled:
+            gc.enable()
+
+
+def freeze_heap():
+    """Move everything alive to the GC's permanent generation, once startup has loaded the data.
+
+    Every full collection would otherwise walk all the loaded records, which
+    are tracked by the GC. Frozen objects are still freed by reference
+    counting. An app calls this from its lifespan after the initial load,
+    and only then: later reloads are not frozen, as each freeze pins what
+    is alive at the time for good. A collection runs first so no garbage is
+    pinned with the records.
+    """
+    gc.collect()
+    gc.freeze()
+
+
+def compact(record_type, record):
+    """``record`` as a ``record_type`` when there is one, else unchanged."""
+    if record_type is None or record is None:
+        return record
+    return record_type.from_dict(record)
+
+
+def plain_records(records):
+    """A dict or list of records with each record as a dict, ready to dump.
+
+    ``default=plain`` gets the same output, but an indenting ``json.dump``
+    runs its pure-Python encoder, where each object handed to ``default``
+    costs a nested generator: converting first writes a large file in
+    about half the time.
+    """
+    if isinstance(records, dict):
+        return {key: record._asdict() if isinstance(record, CompactRecord) else record
+                for key, record in records.items()}
+    return [record._asdict() if isinstance(record, CompactRecord) else record for record in records]
+
+
+def plain(obj):
+    """``default`` hook for JSON encoders: records are written as objects."""
+    if isinstance(obj, CompactRecord):
+        return obj._asdict()
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
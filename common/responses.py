@@ -0,0 +1,161 @@
+"""Response helpers shared by the example apps."""
+import json
+import math
+import time
+from email.utils import formatdate, parsedate_to_datetime
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from common.metrics import timed
+from common.records import CompactRecord, plain
+
+try:
+    import orjson
+except ImportError:  # the stdlib encoder produces the same JSON, only slower
+    orjson = None
+
+
+STREAM_MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'json': 'application/json',
+}
+
+# Serialised records are buffered up to this size before each send, so a
+# large export is neither one huge buffer nor one ASGI message per record.
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def dumps(content):
+    """Compact UTF-8 JSON bytes of already JSON-compatible ``content``.
+
+    Uses orjson when it is installed, otherwise ``json.dumps`` with the
+    settings Starlette's ``JSONResponse`` uses, so the output is the same.
+    Compact records are written as objects.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=plain)
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(',', ':'),
+                      default=plain).encode('utf-8')
+
+
+class FastJSONResponse(JSONResponse):
+    """``JSONResponse`` rendered with ``dumps``; the apps' default response class."""
+
+    def render(self, content):
+        return dumps(content)
+
+
+class BodyCache:
+    """The encoded body of one endpoint, reused while its ETag stays the same.
+
+    Endpoints that send a whole store rebuild the body only after the store
+    version moves on; every other read sends the cached bytes.
+    """
+
+    def __init__(self):
+        self._entry = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, tag, build):
+        entry = self._entry
+        if entry is not None and entry[0] == tag:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        body = build()
+        self._entry = (tag, body)
+        return body
+
+
+def json_response(content, status_code=200, headers=None):
+    """Encode ``content`` the way FastAPI would, timed as the serialization stage."""
+    with timed('serialization'):
+        # records hold JSON values only, so they need no walk of their own
+        return FastJSONResponse(jsonable_encoder(content, custom_encoder={CompactRecord: plain}),
+                                status_code=status_code, headers=headers)
+
+
+def conditional_headers(stamp, *parts, last_modified=None):
+    """ETag and Last-Modified for a body built from a store with ``stamp``.
+
+    ``parts`` and ``last_modified`` account for anything besides the stored
+    data that the body depends on. HTTP dates have whole seconds, so the
+    time is rounded up, which moves the header on when a later write lands
+    in the same second; while that second is still running it is rounded
+    down instead, and ``not_modified`` does not trust it.
+    """
+    if last_modified is None:
+        last_modified = stamp.last_modified
+    seconds = math.ceil(last_modified)
+    if seconds > time.time():
+        seconds = math.floor(last_modified)
+    return {
+        'ETag': stamp.etag(*parts),
+        'Last-Modified': formatdate(seconds, usegmt=True),
+    }
+
+
+def parse_etags(header):
+    """The entity tags of an If-Match header as a set, or None without one."""
+    if header is None:
+        return None
+    return {tag.strip() for tag in header.split(',') if tag.strip()}
+
+
+def not_modified(request: Request, headers):
+    """A 304 with ``headers`` if the client's copy is still current, else None.
+
+    ``If-None-Match`` wins over ``If-Modified-Since`` when both are sent.
+    Nothing is read from the store, so a matching poll costs only this check.
+    """
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+        fresh = '*' in tags or headers['ETag'] in tags
+    else:
+        try:
+            since = parsedate_to_datetime(request.headers.get('if-modified-since', ''))
+            modified = parsedate_to_datetime(headers['Last-Modified'])
+            # within its own second a date may yet be followed by another write
+            fresh = modified <= since and modified.timestamp() + 1 <= time.time()
+        except (TypeError, ValueError):
+            fresh = False
+    return Response(status_code=304, headers=headers) if fresh else None
+
+
+def _frame(records, fmt):
+    if fmt == 'ndjson':
+        for record in records:
+            yield record
+            yield b'\n'
+        return
+    yield b'['
+    for i, record in enumerate(records):
+        if i:
+            yield b','
+        yield record
+    yield b']'
+
+
+def _chunked(parts, size):
+    buffer = bytearray()
+    for part in parts:
+        buffer += part
+        if len(buffer) >= size:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def stream_records(records, fmt='ndjson', chunk_size=STREAM_CHUNK_BYTES, headers=None):
+    """Stream already-serialised JSON records as NDJSON or one JSON array.
+
+    ``records`` is an iterable of ``bytes``, typically a generator, so each
+    record is built and serialised only when the client is ready for it.
+    """
+    return StreamingResponse(_chunked(_frame(records, fmt), chunk_size), media_type=STREAM_MEDIA_TYPES[fmt],
+                             headers=headers)
@@ -0,0 +1,246 @@
+"""Records split by key hash over several stores, same interface as ``JsonStore``."""
+import asyncio
+import glob
+import heapq
+import json
+import os
+import re
+import tempfile
+import threading
+import zlib
+from contextlib import ExitStack
+
+from fastapi import HTTPException
+
+from common.metrics import timed
+from common.records import loading
+from common.store import ABSENT, JsonStore, fsync_directory, run_io
+
+
+class CombinedStamp:
+    """``VersionStamp`` interface over the stamps of several stores.
+
+    Every change bumps one of them, so their sum identifies the combined
+    state just as one store's version does. Reading it only reads their
+    stamps, never loads a store. The epoch is derived from theirs, so it is
+    shared when theirs are.
+    """
+
+    def __init__(self, stores):
+        self.stores = stores
+
+    @property
+    def epoch(self):
+        return sum(store.stamp.epoch for store in self.stores) % 2**64
+
+    @property
+    def version(self):
+        return sum(store.stamp.version for store in self.stores)
+
+    @property
+    def last_modified(self):
+        return max(store.stamp.last_modified for store in self.stores)
+
+    def etag(self, *parts):
+        return self.tag(self.version, *parts)
+
+    def tag(self, version, *parts):
+        return '"' + '-'.join([f"{self.epoch:x}", str(version), *map(str, parts)]) + '"'
+
+
+class ShardedStore:
+    """Records kept in ``shards`` files, each record in the one its key hashes to.
+
+    ``path`` ``employees.json`` with 4 shards is stored as
+    ``employees.0-of-4.json`` to ``employees.3-of-4.json``, each an
+    ordinary ``shard_type`` store (``JsonStore`` or ``WalStore``, built
+    with ``options``). A write rewrites, or appends to the log of, its own
+    shard only. ``load`` reads every shard, from ``aload`` on the I/O pool
+    at startup, so no request ever parses a shard on the event loop. The
+    shard of a key is its CRC-32 modulo the number of shards, which is the
+    same in every process.
+
+    ``items`` merges per-shard snapshots in key order, ``order`` being the
+    sort key of a record key, and yields as it goes. On first load the
+    shards are seeded from ``path`` if it exists; files of a different
+    number of shards are refused rather than read with the wrong hash.
+
+    A batch spanning shards is checked against ``expected`` as a whole and
+    applied in memory holding all their locks, but each shard is written
+    on its own, so a failed write undoes the batch only in that shard.
+    """
+
+    def __init__(self, path, shards, shard_type=JsonStore, order=None, **options):
+        self.path = path
+        self.order = order
+        root, ext = os.path.splitext(path)
+        self._pattern = f"{root}.*-of-*{ext}"
+        self.shards = [shard_type(f"{root}.{i}-of-{shards}{ext}", **options) for i in range(shards)]
+        self.stamp = CombinedStamp(self.shards)
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock, timed('storage'):
+            self._check_shard_count()
+            # the last shard is written last, so a seeding cut short is redone
+            if not os.path.exists(self.shards[-1].path) and os.path.exists(self.path):
+                self._seed()
+            # one load as far as the record pools and the GC are concerned
+            with loading(getattr(self.shards[0], 'record_type', None)):
+                for shard in self.shards:
+                    shard.load()
+        return self
+
+    def _check_shard_count(self):
+        ours = {shard.path for shard in self.shards}
+        for path in glob.glob(self._pattern):
+            match = re.search(r'\.\d+-of-(\d+)\.[^.]*$', path)
+            if path not in ours and match:
+                raise HTTPException(status_code=500, detail=f"{self.path} is split into {match.group(1)} shards, "
+                                                            f"not {len(self.shards)}")
+
+    def _seed(self):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=500, detail=f"Invalid JSON in {self.path}")
+        parts = [{} for _ in self.shards]
+        for key, record in data.items():
+            parts[self.shard_index(key)][key] = record
+        for shard, part in zip(self.shards, parts):
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(shard.path)))
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(part, f, indent=shard.indent)
+                    f.flush()
+                    os.fsync(f.fileno())
+                # unlike a rename, a link never replaces a shard that another
+                # worker seeded first and may have written to since
+                os.link(tmp_path, shard.path)
+                fsync_directory(shard.path)
+            except FileExistsError:
+                pass
+            finally:
+                os.remove(tmp_path)
+
+    def shard_index(self, key):
+        return zlib.crc32(key.encode()) % len(self.shards)
+
+    def shard(self, key):
+        return self.shards[self.shard_index(key)]
+
+    def __contains__(self, key):
+        return key in self.shard(key)
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def get(self, key, default=None):
+        return self.shard(key).get(key, default)
+
+    def get_with_etag(self, key):
+        return self.shard(key).get_with_etag(key)
+
+    def get_with_revision(self, key):
+        return self.shard(key).get_with_revision(key)
+
+    def record_etag(self, key):
+        return self.shard(key).record_etag(key)
+
+    def items(self):
+        """All records in key order, merged lazily from snapshots taken now."""
+        order = self.order
+        item_key = (lambda item: item[0]) if order is None else (lambda item: order(item[0]))
+        snapshots = [sorted(shard.items(), key=item_key) for shard in self.shards]
+        return heapq.merge(*snapshots, key=item_key)
+
+    def values(self):
+        return [record for _, record in self.items()]
+
+    def put(self, key, record):
+        return self.shard(key).put(key, record)
+
+    def insert(self, key, record):
+        return self.shard(key).insert(key, record)
+
+    def delete(self, key):
+        return self.shard(key).delete(key)
+
+    def update(self, key, change, if_match=None):
+        return self.shard(key).update(key, change, if_match)
+
+    def _partition(self, changes):
+        parts = {}
+        for key, record in changes:
+            parts.setdefault(self.shard_index(key), []).append((key, record))
+        return parts
+
+    def _submit(self, changes, expected):
+        """Make the changes in memory; returns the version and one write future per shard."""
+        parts = self._partition(changes)
+        shards = {i: self.shards[i] for i in sorted(parts)}
+        expected = expected or {}
+        expected = {i: {key: revision for key, revision in expected.items() if self.shard_index(key) == i}
+                    for i in shards}
+        with ExitStack() as held:
+            # always in shard order, so two batches never wait on each other; a shard
+            # shared with other workers is brought up to date as it is taken
+            for shard in shards.values():
+                held.enter_context(shard._writing())
+            # the whole batch is checked before any shard is changed
+            for i, shard in shards.items():
+                shard._check_expected(expected[i])
+            durable = [shards[i]._submit(part, expected[i])[1] for i, part in parts.items()]
+        return self.stamp.version, durable
+
+    def apply(self, changes, expected=None):
+        """``JsonStore.apply`` across shards; see the class docstring for failures."""
+        version, durable = self._submit(changes, expected)
+        with timed('storage'):
+            for future in durable:
+                future.result()
+        return version
+
+    async def aload(self):
+        return await run_io(self.load)
+
+    async def arefresh(self):
+        """Bring shards other workers wrote to up to date, on the I/O pool."""
+        stale = [shard for shard in self.shards if getattr(shard, 'stale', False)]
+        if stale:
+            await run_io(self._refresh, stale)
+
+    @staticmethod
+    def _refresh(shards):
+        for shard in shards:
+            shard.refresh()
+
+    async def aput(self, key, record):
+        await self.aapply([(key, record)])
+        return record
+
+    async def ainsert(self, key, record):
+        await self.aapply([(key, record)], expected={key: ABSENT})
+        return record
+
+    async def adelete(self, key):
+        record = self.shard(key).get(key)
+        if record is None:
+            raise KeyError(key)
+        await self.aapply([(key, None)])
+        return record
+
+    async def aapply(self, changes, expected=None):
+        version, durable = await run_io(self._submit, changes, expected)
+        with timed('storage'):
+            await asyncio.gather(*map(asyncio.wrap_future, durable))
+        return version
+
+    async def aupdate(self, key, change, if_match=None):
+        return await self.shard(key).aupdate(key, change, if_match)
+
+    def close(self):
+        with self._lock:
+            for shard in self.shards:
+                shard.close()
@@ -0,0 +1,301 @@
+"""JSON stores that several worker processes serve and write together."""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+from contextlib import contextmanager
+
+from common.records import plain
+from common.store import JsonStore, VersionStamp, file_signature, run_io
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+# epoch, version, and the inode, size and mtime_ns of the data file last written
+COUNTER = struct.Struct('<QQQQq')
+NO_FILE = (0, 0, 0)
+
+
+class SharedCounter:
+    """A change counter in a small file that every worker maps.
+
+    Besides the counter it holds an epoch, fixed when the file is created,
+    and the signature of the data file as of the last counted change.
+    ``locked`` takes an exclusive lock on the file that works across
+    processes; threads of one process must be kept apart by the caller,
+    since they share the one open file. Inside ``locked``, a nested
+    ``locked`` does nothing.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+        self._mm = None
+        self._held = False
+
+    def _open(self):
+        if self._mm is not None:
+            return
+        self._file = open(self.path, 'a+b')
+        with self.locked():
+            if os.fstat(self._file.fileno()).st_size < COUNTER.size:
+                # the first worker to get here starts the count
+                self._file.truncate(0)
+                self._file.write(COUNTER.pack(time.time_ns(), 0, *NO_FILE))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+        self._mm = mmap.mmap(self._file.fileno(), COUNTER.size)
+
+    @contextmanager
+    def locked(self):
+        if self._held:
+            yield
+            return
+        if self._file is None:
+            self._open()
+        self._held = True
+        try:
+            with self._flocked():
+                yield
+        finally:
+            self._held = False
+
+    @contextmanager
+    def _flocked(self):
+        fd = self._file.fileno()
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            return
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            os.lseek(fd, 0, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+    def _fields(self):
+        self._open()
+        return COUNTER.unpack_from(self._mm)
+
+    @property
+    def epoch(self):
+        return self._fields()[0]
+
+    @property
+    def version(self):
+        return self._fields()[1]
+
+    @property
+    def signature(self):
+        return tuple(self._fields()[2:])
+
+    def bump(self, signature=None):
+        """Count a change, with the data file's new signature if it has one; hold ``locked``."""
+        epoch, version, *previous = self._fields()
+        signature = previous if signature is None else signature
+        self._mm[:] = COUNTER.pack(epoch, version + 1, *signature)
+        return version + 1
+
+    def close(self):
+        for resource in (self._mm, self._file):
+            if resource is not None:
+                resource.close()
+        self._mm = self._file = None
+
+
+class SharedStamp(VersionStamp):
+    """``VersionStamp`` whose epoch and versions are those of a ``SharedCounter``.
+
+    ``seen`` is the version the store's data was read at; ``version``
+    first has ``refresh`` bring the store up to the shared counter.
+    """
+
+    def __init__(self, counter, refresh):
+        self.counter = counter
+        self.refresh = refresh
+        self.seen = None
+        self._last_modified = time.time()
+
+    @property
+    def epoch(self):
+        return self.counter.epoch
+
+    @property
+    def version(self):
+        self.refresh()
+        return self.seen
+
+    @property
+    def last_modified(self):
+        self.refresh()
+        return self._last_modified
+
+    def loaded(self, *paths):
+        mtimes = [os.path.getmtime(path) for path in paths if os.path.exists(path)]
+        self.seen = self.counter.version
+        self._last_modified = max(mtimes, default=time.time())
+
+    def bump(self, signature=None):
+        self.seen = self.counter.bump(signature)
+        self._last_modified = time.time()
+        return self.seen
+
+
+def record_digest(record):
+    """Short hash of a record's contents, the same in every process."""
+    encoded = json.dumps(record, sort_keys=True, default=plain).encode()
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+
+def catch_up(store):
+    """FastAPI dependency bringing ``store`` up to date before each request.
+
+    A request that finds another worker has written reloads on the I/O pool
+    here, so its reads and ETags find the store current rather than each
+    reloading on the event loop.
+    """
+    async def dependency():
+        await store.arefresh()
+    return dependency
+
+
+class SharedJsonStore(JsonStore):
+    """``JsonStore`` that stays consistent across the workers serving one file.
+
+    Every worker maps ``path + '.shared'``, a ``SharedCounter`` bumped by
+    each write. A read first compares it with the version its data was
+    loaded at, which costs a read of shared memory rather than a ``stat``,
+    and reloads if another worker has written since. A write holds the
+    counter's file lock throughout: it reloads if it is behind, checks its
+    ``expected`` revisions and absent keys against what it reloaded,
+    applies its changes, rewrites the file and bumps the counter. So a
+    create (``insert``) or an If-Match update is decided against the last
+    completed write of any worker, and no worker serves data older than
+    that write. Plain ``put`` and ``delete`` carry no condition, and the
+    last of them wins.
+
+    ETags mean the same in every worker: ``stamp`` takes its epoch and
+    version from the counter, and a record's revision is a digest of its
+    contents, so a tag read from one worker can be sent in If-Match to
+    another. The counter also keeps the signature of the file it last
+    counted, so an edit by hand, made while workers run or while none do,
+    is counted as a change too. Writes are not group-committed, since each
+    one holds the lock until it is on disk.
+    """
+
+    def __init__(self, path, indent=2, indexes=(), record_type=None):
+        super().__init__(path, indent=indent, indexes=indexes, group_commit=False, record_type=record_type)
+        self.shared = SharedCounter(f"{path}.shared")
+        self.stamp = SharedStamp(self.shared, self.refresh)
+
+    def _reset_revisions(self):
+        # revisions are digests of the records, kept nowhere
+        pass
+
+    def revision(self, key):
+        record = self.data.get(key)
+        return None if record is None else record_digest(record)
+
+    def _committed(self, changes):
+        return self.stamp.bump(self._disk_signature)
+
+    def _submit_update(self, key, change, if_match):
+        new, _, durable = super()._submit_update(key, change, if_match)
+        # the new ETag carries the record's revision, not the store version
+        return new, record_digest(new), durable
+
+    def _catch_up(self):
+        """Count an edit made by hand, then reload if behind; hold the store and file locks."""
+        signature = file_signature(self.path) or NO_FILE
+        if signature != self.shared.signature:
+            self.shared.bump(signature)
+        if self.shared.version == self.stamp.seen:
+            return False
+        super().load()
+        return True
+
+    def load(self):
+        with self._lock, self.shared.locked():
+            self._catch_up()
+        return self.data
+
+    @property
+    def stale(self):
+        """Another worker has written since this one last read."""
+        return self.shared.version != self.stamp.seen
+
+    def refresh(self):
+        """Reload if another worker has written since this one last read."""
+        if not self.stale:
+            return False
+        with self._lock, self.shared.locked():
+            return self._catch_up()
+
+    async def arefresh(self):
+        """``refresh`` with the reload, a parse of the whole file, on the I/O pool."""
+        if not self.stale:
+            return False
+        return await run_io(self.refresh)
+
+    def reload_if_changed(self):
+        with self._lock, self.shared.locked():
+            return self._catch_up()
+
+    @contextmanager
+    def _writing(self):
+        # up to date under the file lock, so ``expected`` is checked against the last write of any worker
+        with self._lock, self.shared.locked():
+            self._catch_up()
+            yield
+
+    def __contains__(self, key):
+        self.refresh()
+        return super().__contains__(key)
+
+    def __len__(self):
+        self.refresh()
+        return super().__len__()
+
+    def get(self, key, default=None):
+        self.refresh()
+        return super().get(key, default)
+
+    def items(self):
+        self.refresh()
+        return super().items()
+
+    def values(self):
+        self.refresh()
+        return super().values()
+
+    def sorted_records(self, field, reverse=False, offset=0, limit=None):
+        self.refresh()
+        return super().sorted_records(field, reverse=reverse, offset=offset, limit=limit)
+
+    def _read_versioned(self, key):
+        self.refresh()
+        return super()._read_versioned(key)
+
+    def delete(self, key):
+        self.refresh()
+        return super().delete(key)
+
+    async def adelete(self, key):
+        await self.arefresh()
+        return await super().adelete(key)
+
+    def close(self):
+        super().close()
+        with self._lock:
+            self.shared.close()
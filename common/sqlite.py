@@ -0,0 +1,232 @@
+"""SQLite storage backend with the same interface as ``JsonStore``."""
+import json
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from fastapi import HTTPException
+
+from common.metrics import timed
+from common.store import KeyLocks, RecordRevisions, VersionStamp, resolved, run_io
+
+
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", 4))
+
+
+class ConnectionPool:
+    """Fixed set of SQLite connections handed out to one thread at a time.
+
+    Each connection keeps its own cache of compiled statements, so the
+    parametrised queries used by the stores are prepared once per connection
+    and then reused.
+    """
+
+    def __init__(self, path, size=SQLITE_POOL_SIZE):
+        self.path = path
+        self._idle = queue.LifoQueue()
+        self._connections = []
+        for _ in range(size):
+            conn = sqlite3.connect(path, check_same_thread=False, cached_statements=256)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # FULL syncs the WAL on every commit; NORMAL could lose the last
+            # commits to a power cut, and the JSON stores fsync every write
+            conn.execute('PRAGMA synchronous=FULL')
+            self._connections.append(conn)
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self._idle.get()
+        try:
+            yield conn
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        for conn in self._connections:
+            conn.close()
+        self._connections = []
+
+
+class SqliteStore(RecordRevisions):
+    """Records keyed by id in one SQLite table, one JSON document per row.
+
+    Fields named in ``columns`` are also stored as indexed columns so
+    ``query`` can filter, sort and page inside SQLite. ``extra_schema``
+    statements (triggers, virtual tables) run once the table exists. On first
+    load an empty table is filled from ``seed_path``, a JSON object keyed by
+    id or a JSON list whose records carry the id in ``seed_key``. Secondary
+    indexes behave as they do for ``JsonStore``.
+    """
+
+    def __init__(self, path, table, columns=None, key_type='TEXT', indexes=(), extra_schema=(),
+                 seed_path=None, seed_key=None, pool_size=SQLITE_POOL_SIZE):
+        self.path = path
+        self.table = table
+        self.columns = dict(columns or {})
+        self.key_type = key_type
+        self.indexes = list(indexes)
+        self.extra_schema = list(extra_schema)
+        self.seed_path = seed_path
+        self.seed_key = seed_key
+        self.pool_size = pool_size
+        self.pool = None
+        self.stamp = VersionStamp()
+        self._write_lock = threading.Lock()
+        self._key_locks = KeyLocks()
+        self._reset_revisions()
+        column_names = ['key', 'value', *self.columns]
+        self._upsert_sql = (
+            f"INSERT INTO {table} ({', '.join(column_names)}) VALUES ({', '.join('?' * len(column_names))}) "
+            f"ON CONFLICT(key) DO UPDATE SET "
+            + ', '.join(f"{name} = excluded.{name}" for name in column_names[1:])
+        )
+        self._delete_sql = f"DELETE FROM {table} WHERE key = ?"
+        self._get_sql = f"SELECT value FROM {table} WHERE key = ?"
+
+    def load(self):
+        if self.pool is None:
+            self.pool = ConnectionPool(self.path, self.pool_size)
+        with timed('storage'), self.pool.connection() as conn:
+            with conn:
+                columns = ''.join(f", {name} {sql_type}" for name, sql_type in self.columns.items())
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} "
+                             f"(key {self.key_type} PRIMARY KEY, value TEXT NOT NULL{columns})")
+                for name in self.columns:
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_{name} ON {self.table} ({name}, key)")
+                for statement in self.extra_schema:
+                    conn.execute(statement)
+            empty = conn.execute(f"SELECT NOT EXISTS (SELECT 1 FROM {self.table})").fetchone()[0]
+        if empty and self.seed_path and os.path.exists(self.seed_path):
+            self.apply(self._read_seed())
+        if self.indexes:
+            data = dict(self.items())
+            for index in self.indexes:
+                index.rebuild(data)
+        self.stamp.loaded(self.path)
+        self._reset_revisions()
+        return self
+
+    def _read_seed(self):
+        try:
+            with open(self.seed_path, 'r') as f:
+                data = json.load(f)
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=500, detail=f"Invalid JSON in {self.seed_path}")
+        if isinstance(data, dict):
+            return list(data.items())
+        return [(record[self.seed_key], record) for record in data]
+
+    def _row(self, key, record):
+        return (key, json.dumps(record), *(record.get(name) for name in self.columns))
+
+    def __contains__(self, key):
+        with self.pool.connection() as conn:
+            return conn.execute(self._get_sql, (key,)).fetchone() is not None
+
+    def __len__(self):
+        with self.pool.connection() as conn:
+            return conn.execute(f"SELECT count(*) FROM {self.table}").fetchone()[0]
+
+    def get(self, key, default=None):
+        with timed('storage'), self.pool.connection() as conn:
+            row = conn.execute(self._get_sql, (key,)).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def items(self):
+        with timed('storage'), self.pool.connection() as conn:
+            rows = conn.execute(f"SELECT key, value FROM {self.table} ORDER BY rowid").fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def values(self):
+        return [record for _, record in self.items()]
+
+    def query(self, where=(), params=(), order_by=None, limit=None, offset=0):
+        """Records matching ``where`` (SQL conditions joined with AND), one page.
+
+        Conditions and ``order_by`` may only name columns; values always go
+        through ``params`` so each query shape is prepared once.
+        """
+        sql = f"SELECT value FROM {self.table}"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        if order_by:
+            sql += f" ORDER BY {order_by}"
+        sql += " LIMIT ? OFFSET ?"
+        with timed('storage'), self.pool.connection() as conn:
+            rows = conn.execute(sql, (*params, -1 if limit is None else limit, offset)).fetchall()
+        return [json.loads(value) for value, in rows]
+
+    def put(self, key, record):
+        self.apply([(key, record)])
+        return record
+
+    def delete(self, key):
+        record = self.get(key)
+        if record is None:
+            raise KeyError(key)
+        self.apply([(key, None)])
+        return record
+
+    def apply(self, changes, expected=None):
+        """Apply ``(key, record)`` changes, ``None`` meaning delete, in one transaction.
+
+        ``expected`` and the return value work as in ``JsonStore.apply``.
+        """
+        if not changes:
+            return self.stamp.version
+        with self._write_lock:
+            # before taking a connection: an insert looks its key up with one
+            self._check_expected(expected)
+            with self.pool.connection() as conn:
+                transitions = []
+                if self.indexes:
+                    pending = {}
+                    for key, record in changes:
+                        if key in pending:
+                            old = pending[key]
+                        else:
+                            row = conn.execute(self._get_sql, (key,)).fetchone()
+                            old = None if row is None else json.loads(row[0])
+                        transitions.append((key, old, record))
+                        pending[key] = record
+                try:
+                    with timed('storage'), conn:
+                        for key, record in changes:
+                            if record is None:
+                                conn.execute(self._delete_sql, (key,))
+                            else:
+                                conn.execute(self._upsert_sql, self._row(key, record))
+                except sqlite3.Error as e:
+                    raise HTTPException(status_code=500, detail=f"Failed to save data: {str(e)}")
+                version = self._committed(changes)
+                for key, old, new in transitions:
+                    for index in self.indexes:
+                        if old is not None:
+                            index.remove(key, old)
+                        if new is not None:
+                            index.insert(key, new)
+        return version
+
+    async def aload(self):
+        return await run_io(self.load)
+
+    def _submit(self, changes, expected=None):
+        # the commit is fsynced (synchronous=FULL), so durable once apply returns
+        return self.apply(changes, expected), resolved()
+
+    async def aput(self, key, record):
+        return await run_io(self.put, key, record)
+
+    async def adelete(self, key):
+        return await run_io(self.delete, key)
+
+    async def aapply(self, changes, expected=None):
+        return await run_io(self.apply, changes, expected)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
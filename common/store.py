@@ -0,0 +1,775 @@
+"""Resident record stores backed by JSON files."""
+import asyncio
+import contextvars
+import functools
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+
+from fastapi import HTTPException
+
+from common.metrics import timed
+from common.records import COMPACT_RECORDS, compact, loading, plain, plain_records
+
+
+# Size of the thread pool that runs blocking file I/O for async handlers.
+STORE_IO_WORKERS = int(os.getenv("STORE_IO_WORKERS", 4))
+
+# Group commit: mutations queued within STORE_COMMIT_WINDOW seconds of the
+# first one share one file write, which starts early once STORE_COMMIT_BATCH
+# are waiting. STORE_GROUP_COMMIT=0 writes every mutation on its own instead.
+STORE_GROUP_COMMIT = os.getenv("STORE_GROUP_COMMIT", "1") != "0"
+STORE_COMMIT_WINDOW = float(os.getenv("STORE_COMMIT_WINDOW", 0.002))
+STORE_COMMIT_BATCH = int(os.getenv("STORE_COMMIT_BATCH", 256))
+
+_io_executor = None
+
+
+def io_executor():
+    """Shared, bounded executor for storage I/O, created on first use."""
+    global _io_executor
+    if _io_executor is None:
+        _io_executor = ThreadPoolExecutor(max_workers=STORE_IO_WORKERS, thread_name_prefix="store-io")
+    return _io_executor
+
+
+async def run_io(func, *args):
+    """Run a blocking storage call on the I/O pool without stalling the event loop."""
+    loop = asyncio.get_running_loop()
+    # Carry the request context over so timed() stages are still recorded.
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(io_executor(), functools.partial(context.run, func, *args))
+
+
+def file_signature(path):
+    """What identifies one version of a file on disk, or None if it is missing.
+
+    ``write_json_atomic`` always creates a new inode, and an edit in place
+    changes the size or mtime, so comparing signatures detects both.
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+def fsync_directory(path):
+    """Make a rename to, or the creation of, ``path`` durable."""
+    if os.name == 'nt':
+        # directories cannot be opened there, and NTFS journals renames
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def write_json_temp(path, data, indent=None):
+    """Write ``data`` next to ``path`` and fsync it; returns the temp file's path.
+
+    Once it is renamed over ``path``, ``fsync_directory`` makes the rename durable.
+    """
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(plain_records(data), f, indent=indent, default=plain)
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp_path
+
+
+def write_json_atomic(path, data, indent=None):
+    """Write ``data`` to a temp file, fsync it and rename it over ``path``.
+
+    A crash part way through leaves the previous file intact.
+    """
+    os.replace(write_json_temp(path, data, indent), path)
+    fsync_directory(path)
+
+
+def resolved():
+    """A future that is already done, for writes that finished synchronously."""
+    future = Future()
+    future.set_result(None)
+    return future
+
+
+class VersionStamp:
+    """Change counter and modification time of a store, for HTTP validators.
+
+    ``version`` goes up on every load and committed change. ``epoch`` differs
+    per process start, so an ETag from before a restart never matches.
+    """
+
+    def __init__(self):
+        self.epoch = time.time_ns()
+        self.version = 0
+        self.last_modified = time.time()
+        self._lock = threading.Lock()
+
+    def loaded(self, *paths):
+        """Bump for freshly loaded data, dated by the newest of ``paths``."""
+        mtimes = [os.path.getmtime(path) for path in paths if os.path.exists(path)]
+        with self._lock:
+            self.version += 1
+            self.last_modified = max(mtimes, default=time.time())
+
+    def bump(self):
+        with self._lock:
+            self.version += 1
+            self.last_modified = time.time()
+            return self.version
+
+    def etag(self, *parts):
+        """Strong ETag for the current version; ``parts`` add any other inputs of the body."""
+        return self.tag(self.version, *parts)
+
+    def tag(self, version, *parts):
+        return '"' + '-'.join([f"{self.epoch:x}", str(version), *map(str, parts)]) + '"'
+
+
+class ConflictError(HTTPException):
+    """A conditional write found the record changed since it was read."""
+
+    def __init__(self, key, detail=None):
+        super().__init__(status_code=409, detail=detail or f"{key} was modified by another request")
+        self.key = key
+
+
+class ExistsError(ConflictError):
+    """An insert found a record already stored under its key; a 400, as the create endpoints answer."""
+
+    def __init__(self, key):
+        super().__init__(key, detail=f"{key} already exists")
+        self.status_code = 400
+
+
+# Expected revision of a key that must have no record: an insert.
+ABSENT = object()
+
+
+class KeyLocks:
+    """One lock per key, created on first use and dropped once nobody holds it."""
+
+    def __init__(self):
+        self._locks = {}
+        self._mutex = threading.Lock()
+
+    @contextmanager
+    def hold(self, key):
+        with self._mutex:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._mutex:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+
+class GroupCommit:
+    """Coalesces the saves of concurrent mutations into one durable write.
+
+    A store applies a mutation to memory under its ``lock`` and, still
+    holding it, ``submit``s the changes with a callable that undoes them.
+    A writer thread waits until ``window`` seconds have passed since the
+    first pending mutation, or ``max_batch`` are pending, takes all of them,
+    calls ``snapshot(changes)`` under the lock and ``write(snapshot)``
+    outside it, and then resolves their futures. Mutations arriving during
+    a write queue up for the next one, so the number of writes stays flat
+    as the number of writers grows. If a write fails, every mutation not yet
+    on disk is undone, newest first, and its future gets the error.
+    """
+
+    def __init__(self, lock, snapshot, write, window=STORE_COMMIT_WINDOW, max_batch=STORE_COMMIT_BATCH):
+        self._lock = lock
+        self._snapshot = snapshot
+        self._write = write
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = []
+        self._unwritten = 0
+        self._first = 0.0
+        self._closing = False
+        self._thread = None
+        self._ready = threading.Condition(threading.Lock())
+
+    def submit(self, changes, undo):
+        """Queue changes already made in memory; the future resolves once they are on disk."""
+        future = Future()
+        with self._ready:
+            if not self._pending:
+                self._first = time.monotonic()
+            self._pending.append((changes, undo, future))
+            self._unwritten += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+                self._thread.start()
+            elif len(self._pending) in (1, self.max_batch):
+                self._ready.notify()
+        return future
+
+    def _run(self):
+        while True:
+            with self._ready:
+                while not self._pending and not self._closing:
+                    self._ready.wait()
+                if not self._pending:
+                    self._thread = None
+                    return
+                deadline = self._first + self.window
+                while len(self._pending) < self.max_batch and not self._closing:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._ready.wait(remaining)
+            self._commit()
+
+    def _commit(self):
+        with self._lock:
+            with self._ready:
+                batch, self._pending = self._pending, []
+            snapshot = self._snapshot([change for changes, _, _ in batch for change in changes])
+        try:
+            self._write(snapshot)
+        except Exception as e:
+            with self._lock:
+                # later mutations were made on top of these, so they go too
+                with self._ready:
+                    batch, self._pending = batch + self._pending, []
+                for _, undo, _ in reversed(batch):
+                    undo()
+            for _, _, future in batch:
+                future.set_exception(e)
+        else:
+            for _, _, future in batch:
+                future.set_result(None)
+        with self._ready:
+            self._unwritten -= len(batch)
+
+    @property
+    def idle(self):
+        """No mutation is waiting for its write; stable while the store lock is held."""
+        return self._unwritten == 0
+
+    def close(self):
+        """Write whatever is pending and stop the writer thread."""
+        with self._ready:
+            thread = self._thread
+            self._closing = True
+            self._ready.notify()
+        if thread is not None:
+            thread.join()
+        with self._ready:
+            self._closing = False
+
+
+class RecordRevisions:
+    """Per-record revisions and lock-per-record updates, shared by the stores.
+
+    A record's revision is the store version of its last committed change,
+    or of the last load if it has not changed since; ``record_etag`` turns
+    it into an ETag. ``update`` is a read-modify-write that holds only that
+    record's lock, so edits of different records validate in parallel and
+    meet only at the commit, which re-checks the revision it started from.
+    """
+
+    def _reset_revisions(self):
+        self.revisions = {}
+        self._base_revision = self.stamp.version
+
+    def revision(self, key):
+        return self.revisions.get(key, self._base_revision)
+
+    def record_etag(self, key):
+        return self.stamp.tag(self.revision(key))
+
+    def _read_versioned(self, key):
+        # revision first: a record newer than its revision only causes a retry
+        revision = self.revision(key)
+        return revision, self.get(key)
+
+    def get_with_etag(self, key):
+        """The record (or None) and the ETag to send back in If-Match."""
+        revision, record = self._read_versioned(key)
+        return record, self.stamp.tag(revision)
+
+    def get_with_revision(self, key):
+        """The record (or None) and the revision to pass in ``expected``."""
+        revision, record = self._read_versioned(key)
+        return record, revision
+
+    def sorted_records(self, field, reverse=False, offset=0, limit=None):
+        """One page of records in order of ``field``, walking the index on it."""
+        index = next(index for index in self.indexes if index.field == field)
+        return [self.get(key) for key in index.keys(reverse=reverse, offset=offset, limit=limit)]
+
+    def _check_expected(self, expected):
+        for key, revision in (expected or {}).items():
+            if revision is ABSENT:
+                if self.get(key) is not None:
+                    raise ExistsError(key)
+            elif self.revision(key) != revision:
+                raise ConflictError(key)
+
+    def insert(self, key, record):
+        """Store ``record`` under a new ``key``; raises ExistsError if it has one.
+
+        The key is checked by the commit itself, under the store lock, so of
+        concurrent inserts of one key exactly one succeeds.
+        """
+        self.apply([(key, record)], expected={key: ABSENT})
+        return record
+
+    async def ainsert(self, key, record):
+        await self.aapply([(key, record)], expected={key: ABSENT})
+        return record
+
+    def _committed(self, changes):
+        version = self.stamp.bump()
+        for key, record in changes:
+            if record is None:
+                self.revisions.pop(key, None)
+            else:
+                self.revisions[key] = version
+        return version
+
+    def update(self, key, change, if_match=None):
+        """Replace a record with ``change(copy_of_record)`` without losing other edits.
+
+        ``if_match`` holds the ETags of an If-Match header; unless it has
+        ``*`` or the record's current tag, ConflictError is raised. Without
+        it, a commit by someone else in the meantime just makes ``change``
+        run again on the newer record. Returns the new record and its ETag;
+        raises KeyError if there is no such record.
+        """
+        new, version, durable = self._submit_update(key, change, if_match)
+        with timed('storage'):
+            durable.result()
+        return new, self.stamp.tag(version)
+
+    async def aupdate(self, key, change, if_match=None):
+        new, version, durable = await run_io(self._submit_update, key, change, if_match)
+        with timed('storage'):
+            await asyncio.wrap_future(durable)
+        return new, self.stamp.tag(version)
+
+    def _submit_update(self, key, change, if_match):
+        # the record lock covers the change in memory, not the wait for the write
+        with self._key_locks.hold(key):
+            while True:
+                revision, record = self._read_versioned(key)
+                if record is None:
+                    raise KeyError(key)
+                if if_match is not None and '*' not in if_match and self.stamp.tag(revision) not in if_match:
+                    raise ConflictError(key)
+                new = change(dict(record))
+                try:
+                    version, durable = self._submit([(key, new)], expected={key: revision})
+                except ConflictError:
+                    if if_match is not None:
+                        raise
+                    continue
+                return new, version, durable
+
+
+class JsonStore(RecordRevisions):
+    """Records keyed by id, loaded once and written through to a JSON file.
+
+    Reads are served from ``self.data``; every mutation updates memory and
+    then rewrites the file. If the write fails the in-memory change is rolled
+    back so memory never drifts ahead of disk. Secondary indexes passed in
+    ``indexes`` are updated on every change; a load builds new ones aside and
+    swaps them in together with the data, so ``sorted_records`` never pairs
+    one snapshot's index with another's records.
+
+    Async handlers use the ``a``-prefixed methods, which run the blocking
+    call on the shared I/O pool. ``items`` and ``values`` return snapshots so
+    callers can iterate while a write is applied on another thread.
+    ``stamp`` changes whenever the data does, for ETag/Last-Modified.
+
+    The store remembers the signature of the file it last read or wrote, so
+    ``reload_if_changed`` can pick up edits made by someone else.
+
+    With ``group_commit`` the file is written by a ``GroupCommit`` instead
+    of by each mutation: a mutation still returns only once it is on disk,
+    but concurrent ones share the write. With a ``record_type`` (a
+    ``CompactRecord``) records are held in that form rather than as dicts.
+    """
+
+    def __init__(self, path, indent=2, indexes=(), group_commit=STORE_GROUP_COMMIT, record_type=None):
+        self.path = path
+        self.indent = indent
+        self.record_type = record_type if COMPACT_RECORDS else None
+        self._view = ({}, list(indexes))
+        self.stamp = VersionStamp()
+        self._disk_signature = None
+        self._lock = threading.RLock()
+        self._key_locks = KeyLocks()
+        self._reset_revisions()
+        self._commits = GroupCommit(self._lock, self._snapshot, self._write) if group_commit else None
+
+    @property
+    def data(self):
+        return self._view[0]
+
+    @property
+    def indexes(self):
+        return self._view[1]
+
+    def load(self):
+        with self._lock, timed('storage'), loading(self.record_type):
+            # taken before reading, so an edit made during the read is seen next time
+            signature = file_signature(self.path)
+            self._set_data(self._read_snapshot())
+            self._disk_signature = signature
+            self.stamp.loaded(self.path)
+            self._reset_revisions()
+        return self.data
+
+    def reload_if_changed(self):
+        """Reload if the file changed since this store last read or wrote it.
+
+        The new snapshot and its indexes replace the old ones under the store
+        lock, as a write would. If the file does not parse (an edit still in
+        progress) the current data stays and the error is raised.
+        """
+        with self._lock:
+            # pending writes were made on top of the current data; look again later
+            if self._commits is not None and not self._commits.idle:
+                return False
+            if file_signature(self.path) == self._disk_signature:
+                return False
+            self.load()
+            return True
+
+    def _set_data(self, data):
+        if self.record_type is not None:
+            data = {key: self.record_type.from_dict(record) for key, record in data.items()}
+        indexes = [index.rebuilt(data) for index in self.indexes]
+        self._view = (data, indexes)
+
+    def _reindex(self, key, old, new):
+        for index in self.indexes:
+            if old is not None:
+                index.remove(key, old)
+            if new is not None:
+                index.insert(key, new)
+
+    def _read_snapshot(self):
+        try:
+            with open(self.path, 'r') as f:
+                # records are made compact as they are parsed, not after
+                return json.load(f, object_hook=self.record_type and self.record_type.from_dict)
+        except FileNotFoundError:
+            return {}
+        except json.JSONDecodeError:
+            raise HTTPException(status_code=500, detail=f"Invalid JSON in {self.path}")
+
+    def save(self):
+        with self._lock:
+            self._write(self.data)
+
+    def _snapshot(self, changes):
+        # records are replaced, never changed in place, so a shallow copy will do
+        return dict(self.data)
+
+    def _write(self, data):
+        try:
+            with timed('storage'):
+                tmp_path = write_json_temp(self.path, data, indent=self.indent)
+                # the rename and the new signature go together, or the watcher
+                # could take this write for an outside edit and reload it
+                with self._lock:
+                    os.replace(tmp_path, self.path)
+                    self._disk_signature = file_signature(self.path)
+                fsync_directory(self.path)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to save data: {str(e)}")
+
+    def __contains__(self, key):
+        return key in self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def items(self):
+        return list(self.data.items())
+
+    def sorted_records(self, field, reverse=False, offset=0, limit=None):
+        data, indexes = self._view
+        index = next(index for index in indexes if index.field == field)
+        return [data.get(key) for key in index.keys(reverse=reverse, offset=offset, limit=limit)]
+
+    def values(self):
+        return list(self.data.values())
+
+    def put(self, key, record):
+        self.apply([(key, record)])
+        return record
+
+    def delete(self, key):
+        record = self.data[key]
+        self.apply([(key, None)])
+        return record
+
+    def _read_versioned(self, key):
+        with self._lock:
+            return self.revision(key), self.data.get(key)
+
+    def apply(self, changes, expected=None):
+        """Apply ``(key, record)`` changes, ``None`` meaning delete, with one write.
+
+        Either every change reaches disk or none of them stays in memory.
+        ``expected`` maps keys to the revisions the caller read; if any has
+        moved on, ConflictError is raised and nothing is applied. Returns
+        the store version of the commit.
+        """
+        version, durable = self._submit(changes, expected)
+        # a group commit writes on its own thread, outside this request, so
+        # the wait for it is what the request spends on storage
+        with timed('storage'):
+            durable.result()
+        return version
+
+    def _writing(self):
+        """Held by a write from its ``expected`` check until its changes are made."""
+        return self._lock
+
+    def _submit(self, changes, expected):
+        """Make the changes in memory; returns their version and a future for the write."""
+        if not changes:
+            return self.stamp.version, resolved()
+        if self.record_type is not None:
+            changes = [(key, compact(self.record_type, record)) for key, record in changes]
+        with self._writing():
+            self._check_expected(expected)
+            undo = []
+            for key, record in changes:
+                previous = self.data.get(key)
+                undo.append((key, previous))
+                if record is None:
+                    self.data.pop(key, None)
+                else:
+                    self.data[key] = record
+                self._reindex(key, previous, record)
+            if self._commits is not None:
+                version = self._committed(changes)
+                return version, self._commits.submit(changes, functools.partial(self._rollback, undo))
+            try:
+                self._persist(changes)
+            except Exception:
+                self._rollback(undo)
+                raise
+            return self._committed(changes), resolved()
+
+    def _rollback(self, undo):
+        for key, previous in reversed(undo):
+            current = self.data.get(key)
+            if previous is None:
+                self.data.pop(key, None)
+            else:
+                self.data[key] = previous
+            self._reindex(key, current, previous)
+        # readers may have seen the rolled-back change, so move on anyway
+        self.stamp.bump()
+
+    async def aload(self):
+        return await run_io(self.load)
+
+    async def aput(self, key, record):
+        await self.aapply([(key, record)])
+        return record
+
+    async def adelete(self, key):
+        record = self.data[key]
+        await self.aapply([(key, None)])
+        return record
+
+    async def aapply(self, changes, expected=None):
+        # wait for the write on the event loop rather than holding a pool thread
+        version, durable = await run_io(self._submit, changes, expected)
+        with timed('storage'):
+            await asyncio.wrap_future(durable)
+        return version
+
+    def _persist(self, changes):
+        self.save()
+
+    def close(self):
+        if self._commits is not None:
+            self._commits.close()
+
+
+class WalStore(JsonStore):
+    """JsonStore that appends one log record per mutation instead of rewriting.
+
+    The JSON file at ``path`` is the last snapshot and ``path + '.log'`` holds
+    newline-delimited ``put``/``delete`` records written since. A batch from
+    ``apply`` is one ``batch`` record, so a crash can never leave half of it
+    in the log. ``load`` replays
+    the log on top of the snapshot. Once the log grows past
+    ``compact_threshold`` bytes a background thread folds it into a new
+    snapshot, so write cost depends on the size of the change rather than on
+    the number of records. With group commit a batch of mutations is one
+    record and one fsync.
+    """
+
+    def __init__(self, path, indent=2, indexes=(), compact_threshold=1024 * 1024, fsync=True,
+                 group_commit=STORE_GROUP_COMMIT, record_type=None):
+        super().__init__(path, indent=indent, indexes=indexes, group_commit=group_commit, record_type=record_type)
+        self.log_path = f"{path}.log"
+        self.compact_threshold = compact_threshold
+        self.fsync = fsync
+        self._log = None
+        self._compacting = None
+
+    def load(self):
+        with self._lock, timed('storage'), loading(self.record_type):
+            data = self._read_snapshot()
+            # A log left behind by an interrupted compaction is older than the
+            # live log; replaying it again is harmless because records are
+            # whole-value puts and deletes.
+            replayed = False
+            for log_path in (self._compacting_path, self.log_path):
+                replayed = self._replay(log_path, data) or replayed
+            self._set_data(data)
+            self.stamp.loaded(self.path, self.log_path)
+            self._reset_revisions()
+            if self._log is None:
+                self._open_log()
+        if replayed:
+            # Start from a clean log so a torn tail is never appended to.
+            self.compact()
+        return self.data
+
+    @property
+    def _compacting_path(self):
+        return f"{self.log_path}.compacting"
+
+    def _replay(self, log_path, data):
+        try:
+            with open(log_path, 'rb') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return False
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Only the final record can be torn by a crash mid-append.
+                break
+            if entry['op'] == 'batch':
+                changes = entry['changes']
+            else:
+                changes = [(entry['key'], entry.get('value'))]
+            for key, record in changes:
+                if record is None:
+                    data.pop(key, None)
+                else:
+                    data[key] = record
+        return True
+
+    @staticmethod
+    def _entry(changes):
+        if len(changes) > 1:
+            return {'op': 'batch', 'changes': [list(change) for change in changes]}
+        key, record = changes[0]
+        if record is None:
+            return {'op': 'delete', 'key': key}
+        return {'op': 'put', 'key': key, 'value': record}
+
+    def _persist(self, changes):
+        line = json.dumps(self._entry(changes), default=plain).encode() + b'\n'
+        offset = self._log.tell()
+        try:
+            with timed('storage'):
+                self._log.write(line)
+                self._log.flush()
+                if self.fsync:
+                    os.fsync(self._log.fileno())
+        except Exception as e:
+            # Drop any partial record so the next append starts on a new line.
+            self._log.truncate(offset)
+            raise HTTPException(status_code=500, detail=f"Failed to save data: {str(e)}")
+        if self._log.tell() >= self.compact_threshold and self._compacting is None:
+            self._compacting = threading.Thread(target=self.compact, daemon=True)
+            self._compacting.start()
+
+    def _snapshot(self, changes):
+        return changes
+
+    def _write(self, changes):
+        # the log is appended to under the lock, which compaction rotates it under
+        with self._lock:
+            self._persist(changes)
+
+    def reload_if_changed(self):
+        """Never reloads; returns False.
+
+        Most changes live only in the log and compaction rewrites the
+        snapshot in the background, so a hand-edited snapshot cannot be
+        merged. Apps do not watch a WalStore's file.
+        """
+        return False
+
+    def _open_log(self):
+        self._log = open(self.log_path, 'ab')
+        if self.fsync:
+            # appends are fsynced, which keeps them only if the file itself is kept
+            fsync_directory(self.log_path)
+
+    def compact(self):
+        """Fold the log into a new snapshot and drop it.
+
+        The snapshot is the old one with the rotated log replayed on top, not
+        a copy of memory: memory may hold group-committed changes whose log
+        record is not written yet, and which are undone if that write fails.
+        """
+        with self._lock:
+            # Rotate the log so writers keep appending while the snapshot is
+            # written outside the lock.
+            self._log.close()
+            if os.path.exists(self._compacting_path):
+                # A previous compaction failed; keep its records ahead of ours.
+                with open(self._compacting_path, 'ab') as dst, open(self.log_path, 'rb') as src:
+                    shutil.copyfileobj(src, dst)
+                    dst.flush()
+                    if self.fsync:
+                        os.fsync(dst.fileno())
+                os.remove(self.log_path)
+            else:
+                os.replace(self.log_path, self._compacting_path)
+            self._open_log()
+        try:
+            try:
+                with open(self.path, 'r') as f:
+                    snapshot = json.load(f)
+            except FileNotFoundError:
+                snapshot = {}
+            self._replay(self._compacting_path, snapshot)
+            # the new snapshot must be on disk before the log it replaces goes
+            write_json_atomic(self.path, snapshot, indent=self.indent)
+            os.remove(self._compacting_path)
+        finally:
+            self._compacting = None
+
+    def close(self):
+        super().close()
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
@@ -0,0 +1,56 @@
+"""Background reload of stores whose file is edited outside the app."""
+import logging
+import os
+import threading
+
+
+# Seconds between checks of a watched file; 0 turns watching off.
+STORE_WATCH_INTERVAL = float(os.getenv("STORE_WATCH_INTERVAL", 1.0))
+
+logger = logging.getLogger(__name__)
+
+
+class FileWatcher:
+    """Polls a store's file and reloads the store after an outside edit.
+
+    ``store`` is anything with ``reload_if_changed()``; each check is one
+    ``stat`` call, and the store ignores changes it wrote itself. After a
+    reload ``on_reload`` runs, e.g. to drop caches keyed on the old data.
+    A file that does not parse is retried on the next check while the
+    previous snapshot keeps being served.
+    """
+
+    def __init__(self, store, interval=STORE_WATCH_INTERVAL, on_reload=None):
+        self.store = store
+        self.interval = interval
+        self.on_reload = on_reload
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="store-watch", daemon=True)
+            self._thread.start()
+        return self
+
+    def check(self):
+        try:
+            reloaded = self.store.reload_if_changed()
+        except Exception as e:
+            # usually a file caught mid-write; the next check tries again
+            logger.warning("Reloading %s failed, keeping the current data: %s",
+                           getattr(self.store, 'path', self.store), getattr(e, 'detail', e))
+            return False
+        if reloaded and self.on_reload is not None:
+            self.on_reload()
+        return reloaded
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None